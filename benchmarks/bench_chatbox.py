@@ -0,0 +1,246 @@
+# headless benchmarks of ChatBox, run with streamlit AppTest, no browser or network required.
+#
+#   python benchmarks/bench_chatbox.py --sizes 10 100 1000 5000 --output result.json
+#   python benchmarks/bench_chatbox.py --compare result.json --threshold 1.2
+#
+# import time of the package is measured in fresh processes.
+# every benchmark reports wall time and peak memory traced by tracemalloc, results are written as json.
+
+from typing import *
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+import streamlit_chatbox
+
+
+APP = '''
+import json
+import time
+import streamlit as st
+from streamlit_chatbox import ChatBox, Markdown, BinaryReader
+
+params = st.session_state["bench"]
+box = ChatBox(use_rich_markdown=False)
+
+
+# restoring is measured without ChatBox.from_dict, whose init_session(clear=True) sleeps for a fixed time
+def restore(data):
+    name = data["cur_chat_name"]
+    return box._load_chat(data["histories"][name])
+
+
+if "bench_loaded" not in st.session_state:
+    history = []
+    for i in range(params["messages"]):
+        role = "user" if i % 2 == 0 else "assistant"
+        text = f"message {i} " + "lorem ipsum dolor sit amet " * params["words"]
+        history.append({"role": role, "elements": [Markdown(text).to_dict()], "metadata": {}})
+    box.from_dict({
+        "cur_chat_name": "default",
+        "session_key": "chat_history",
+        "user_avatar": "user",
+        "assistant_avatar": "assistant",
+        "greetings": [],
+        "histories": {"default": {"history": history, "context": {}}},
+    })
+    st.session_state["bench_loaded"] = True
+
+task = params["task"]
+result = {}
+if task == "output_messages":
+    box.output_messages()
+    result.update(box.render_report)
+elif task == "update_msg":
+    box.output_messages()
+    box.ai_say("")
+    text = ""
+    start = time.perf_counter()
+    for i in range(params["chunks"]):
+        text += "token "
+        box.update_msg(text, streaming=True)
+    box.update_msg(text, streaming=False)
+    result["seconds"] = time.perf_counter() - start
+elif task == "filter_history":
+    start = time.perf_counter()
+    box.filter_history(history_len=10)
+    result["history_len"] = time.perf_counter() - start
+    start = time.perf_counter()
+    box.filter_history(history_len=10, filter=lambda msg: {"role": msg["role"], "content": msg["elements"][0].content})
+    result["filter"] = time.perf_counter() - start
+    start = time.perf_counter()
+    box.filter_history(max_tokens=4000)
+    result["max_tokens"] = time.perf_counter() - start
+elif task == "serialize":
+    start = time.perf_counter()
+    data = box.to_json()
+    result["to_json"] = time.perf_counter() - start
+    result["json_bytes"] = len(data.encode("utf-8"))
+    start = time.perf_counter()
+    restore(json.loads(data))
+    result["from_dict"] = time.perf_counter() - start
+    start = time.perf_counter()
+    data = box.save_binary(compression="zlib")
+    result["save_binary"] = time.perf_counter() - start
+    result["binary_bytes"] = len(data)
+    start = time.perf_counter()
+    with BinaryReader(data) as reader:
+        restore(reader.load())
+    result["load_binary"] = time.perf_counter() - start
+st.session_state["bench_result"] = result
+'''
+
+
+def run_app(params: Dict, repeat: int) -> Tuple[List[float], int, List[Dict]]:
+    '''
+    run the app once to load history, then rerun it `repeat` times.
+    return wall time of reruns, peak traced memory and results reported by the app.
+    '''
+    at = AppTest.from_string(APP, default_timeout=600)
+    at.session_state["bench"] = params
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+    times = []
+    results = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            at.run()
+            times.append(time.perf_counter() - start)
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            results.append(at.session_state["bench_result"])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak, results
+
+
+IMPORT_SCRIPT = '''
+import sys, time
+import streamlit
+start = time.perf_counter()
+import streamlit_chatbox
+print(time.perf_counter() - start)
+print(",".join(x for x in ["streamlit_feedback", "streamlit_markdown", "simplejson", "sqlite3"] if x in sys.modules))
+'''
+
+
+def bench_import(repeat: int) -> Dict:
+    '''
+    time of `import streamlit_chatbox` in fresh processes, after streamlit is imported.
+    '''
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, text=True, check=True,
+                             cwd=Path(__file__).absolute().parent.parent).stdout.splitlines()
+        times.append(float(out[0]))
+    modules = out[1].split(",") if len(out) > 1 and out[1] else []
+    return record("import", 0, times, 0, optional_modules_loaded=modules)
+
+
+def record(name: str, messages: int, times: List[float], peak: int, **extra) -> Dict:
+    return {
+        "benchmark": name,
+        "messages": messages,
+        "seconds": statistics.median(times),
+        "seconds_min": min(times),
+        "peak_bytes": peak,
+        **extra,
+    }
+
+
+def bench(sizes: List[int], repeat: int, words: int, chunks: int) -> List[Dict]:
+    records = [bench_import(max(repeat, 5))]
+    for n in sizes:
+        params = {"messages": n, "words": words}
+
+        times, peak, results = run_app({**params, "task": "output_messages"}, repeat)
+        records.append(record("output_messages", n, times, peak, **results[-1]))
+
+        _, peak, results = run_app({**params, "task": "update_msg", "chunks": chunks}, repeat)
+        times = [x["seconds"] for x in results]
+        records.append(record("update_msg", n, times, peak,
+                              chunks=chunks, chunks_per_second=chunks / statistics.median(times)))
+
+        _, peak, results = run_app({**params, "task": "filter_history"}, repeat)
+        for key in ["history_len", "filter", "max_tokens"]:
+            records.append(record(f"filter_history.{key}", n, [x[key] for x in results], peak))
+
+        _, peak, results = run_app({**params, "task": "serialize"}, repeat)
+        records.append(record("to_json", n, [x["to_json"] for x in results], peak,
+                              json_bytes=results[-1]["json_bytes"]))
+        records.append(record("from_dict", n, [x["from_dict"] for x in results], peak))
+        records.append(record("save_binary", n, [x["save_binary"] for x in results], peak,
+                              binary_bytes=results[-1]["binary_bytes"]))
+        records.append(record("load_binary", n, [x["load_binary"] for x in results], peak))
+
+        print(f"{n} messages done", file=sys.stderr)
+    return records
+
+
+def compare(records: List[Dict], baseline: List[Dict], threshold: float) -> List[str]:
+    '''
+    return descriptions of benchmarks slower than baseline by more than threshold times
+    '''
+    base = {(x["benchmark"], x["messages"]): x for x in baseline}
+    slower = []
+    for x in records:
+        if (b := base.get((x["benchmark"], x["messages"]))) and b["seconds"] > 0:
+            ratio = x["seconds"] / b["seconds"]
+            if ratio > threshold:
+                slower.append(f"{x['benchmark']}[{x['messages']}]: {b['seconds']:.4f}s -> {x['seconds']:.4f}s ({ratio:.2f}x)")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="headless benchmarks of streamlit-chatbox")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000], help="numbers of history messages")
+    parser.add_argument("--repeat", type=int, default=3, help="reruns per benchmark, median time is reported")
+    parser.add_argument("--words", type=int, default=20, help="repeated phrases per message")
+    parser.add_argument("--chunks", type=int, default=500, help="streaming updates in update_msg benchmark")
+    parser.add_argument("--output", help="write json results to file instead of stdout")
+    parser.add_argument("--compare", help="json results of a baseline run, exit with 1 if any benchmark is slower")
+    parser.add_argument("--threshold", type=float, default=1.2, help="allowed slowdown ratio against baseline")
+    args = parser.parse_args()
+
+    result = {
+        "streamlit_chatbox": getattr(streamlit_chatbox, "__version__", None),
+        "streamlit": st.__version__,
+        "python": platform.python_version(),
+        "records": bench(args.sizes, args.repeat, args.words, args.chunks),
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+    for x in result["records"]:
+        size = x.get("json_bytes", x.get("binary_bytes"))
+        extra = f"  {size} bytes" if size is not None else ""
+        print(f"{x['benchmark']:<30}{x['messages']:>6}{x['seconds'] * 1000:>12.2f} ms"
+              f"{x['peak_bytes'] / 1024 / 1024:>10.1f} MB{extra}", file=sys.stderr)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["records"]
+        if slower := compare(result["records"], baseline, args.threshold):
+            print("slower than baseline:", *slower, sep="\n  ", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,5 +25,9 @@ setuptools.setup(
         'simplejson',
         'streamlit-feedback',
         'streamlit-markdown>=1.0.9',
-    ]
+    ],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'zstd': ['zstandard'],
+    },
 )
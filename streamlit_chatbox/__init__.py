@@ -1,13 +1,26 @@
 from typing import *
 # from streamlit_option_menu import option_menu
-import asyncio
 from .messages import *
 from .thirdpart import *
+from .streaming import run_async, get_event_loop
+from .metrics import Metrics, enable_metrics, disable_metrics, get_metrics
+from .serialization import dump_binary, load_binary, BinaryReader
 
 
 __version__ = "1.1.13.post1"
 
 
+def __getattr__(name: str) -> Any:
+    # optional components are imported on first use, keep names exported before available
+    if name in ("st_markdown", "st_hack_markdown"):
+        from . import thirdpart
+        return getattr(thirdpart, name)
+    if name == "streamlit_feedback":
+        from streamlit_feedback import streamlit_feedback
+        return streamlit_feedback
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 __all__ = [
     "ChatBox",
     "Markdown",
@@ -16,11 +29,19 @@ __all__ = [
     "Video",
     "Json",
     "OutputElement",
+    "ChatHistory",
+    "Message",
+    "BlobStore",
+    "ChatStore",
+    "SQLiteChatStore",
+    "HistoryCache",
+    "Metrics",
+    "enable_metrics",
+    "disable_metrics",
+    "get_metrics",
+    "dump_binary",
+    "load_binary",
+    "BinaryReader",
     "FakeLLM",
     "FakeAgent",
 ]
-
-
-def run_async(cor) -> Any:
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(cor)
@@ -0,0 +1,124 @@
+from typing import *
+from pathlib import Path
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import threading
+
+
+BLOB_PREFIX = "blob:sha256:"
+MEDIA_OUTPUT_METHODS = ["image", "audio", "video"]
+_DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobRef:
+    '''
+    reference to a payload in a BlobStore, used as content of media elements.
+    payload is read only when the element is rendered.
+    '''
+    __slots__ = ("digest", "store")
+
+    def __init__(self, digest: str, store: "BlobStore") -> None:
+        self.digest = digest
+        self.store = store
+
+    @property
+    def uri(self) -> str:
+        return BLOB_PREFIX + self.digest
+
+    def resolve(self) -> bytes:
+        return self.store.get(self.digest)
+
+    def __repr__(self) -> str:
+        return self.uri
+
+
+class BlobStore:
+    '''
+    content-addressed store of binary payloads on local disk.
+    payloads are deduplicated by sha256 and reference counted, call `gc` to remove unreferenced ones.
+    reference counts are kept in memory of current process, so share one store between sessions,
+    for example create it with st.cache_resource.
+    only elements materialized in memory hold references, chats kept raw, stored in backend, spilled or archived do not.
+    '''
+    def __init__(self, root: Union[str, Path] = None) -> None:
+        if root is None:
+            root = Path(tempfile.gettempdir()) / "streamlit_chatbox_blobs"
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        return (type(self), (self._root,))
+
+    def __copy__(self) -> "BlobStore":
+        return self
+
+    def __deepcopy__(self, memo: Dict) -> "BlobStore":
+        return self
+
+    def _path(self, digest: str) -> Path:
+        # digests may come from imported files, never let them point outside of root
+        if not isinstance(digest, str) or not _DIGEST_RE.fullmatch(digest):
+            raise ValueError(f"invalid blob digest: {digest!r}")
+        return self._root / digest[:2] / digest[2:]
+
+    def put(self, data: bytes) -> BlobRef:
+        '''
+        save data if not exists and increase its reference count.
+        '''
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent)
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp, path)
+        self.incref(digest)
+        return BlobRef(digest, self)
+
+    def ref(self, uri_or_digest: str) -> BlobRef:
+        '''
+        get reference of a stored payload by digest or uri, without changing reference count.
+        raise ValueError if the digest is not a sha256 hex digest.
+        '''
+        digest = uri_or_digest[len(BLOB_PREFIX):] if uri_or_digest.startswith(BLOB_PREFIX) else uri_or_digest
+        self._path(digest)
+        return BlobRef(digest, self)
+
+    def get(self, digest: str) -> bytes:
+        with open(self._path(digest), "rb") as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:]
+
+    def __contains__(self, digest: str) -> bool:
+        return self._path(digest).exists()
+
+    def incref(self, digest: str) -> None:
+        with self._lock:
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+
+    def decref(self, digest: str) -> None:
+        with self._lock:
+            if digest in self._refs:
+                self._refs[digest] -= 1
+
+    def gc(self, keep: Iterable[str] = ()) -> List[str]:
+        '''
+        remove payloads whose reference count dropped to zero, except digests in `keep`, return removed digests.
+        it is only safe when every chat referencing the store is in memory,
+        otherwise pass digests referenced by stored chats as `keep`, such as `ChatBox.blob_digests()` of every session.
+        '''
+        keep = set(keep)
+        with self._lock:
+            removed = [k for k, v in self._refs.items() if v <= 0 and k not in keep]
+            for digest in removed:
+                del self._refs[digest]
+                self._path(digest).unlink(missing_ok=True)
+        return removed
@@ -0,0 +1,198 @@
+from typing import *
+from collections import OrderedDict
+import threading
+import time
+from streamlit_chatbox.serialization import dump_value
+from streamlit_chatbox.storage import ChatStore, storable_message
+
+
+MESSAGE_OVERHEAD = 300
+ELEMENT_OVERHEAD = 200
+
+
+def estimate_size(chat: Dict) -> int:
+    '''
+    rough memory size of a chat in bytes, counting length of contents and a fixed overhead per message/element.
+    '''
+    size = 0
+    for msg in chat["history"]:
+        size += MESSAGE_OVERHEAD
+        for e in msg["elements"]:
+            content = e.content
+            size += ELEMENT_OVERHEAD + (len(content) if isinstance(content, (str, bytes)) else 0)
+    return size
+
+
+class HistoryCache:
+    '''
+    process wide LRU cache of chats shared by all sessions, sessions only keep handles in st.session_state.
+    when total size exceeds `max_bytes`, or a chat is not accessed for `idle_seconds`,
+    least recently used chats are written to `spill` store and dropped from memory, they are loaded again when accessed.
+    chats pinned by `pin` are never evicted. ChatBox pins chats it accesses until the next run of the same session,
+    pins of sessions without runs for `idle_seconds` are released.
+    create it once with st.cache_resource.
+    '''
+    def __init__(
+        self,
+        spill: ChatStore,
+        max_bytes: int = 256 * 1024 * 1024,
+        idle_seconds: float = 30 * 60,
+        check_interval: float = 1,
+    ) -> None:
+        self._spill = spill
+        self._max_bytes = max_bytes
+        self._idle_seconds = idle_seconds
+        self._check_interval = check_interval
+        self._chats: "OrderedDict[str, Dict]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._accessed: Dict[str, float] = {}
+        self._stale: Set[str] = set()
+        # number of owners pinning every chat, and {owner: (keys, time of last pin)}
+        self._pins: Dict[str, int] = {}
+        self._owners: Dict[str, Tuple[Set[str], float]] = {}
+        self._total = 0
+        self._last_check = time.monotonic()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._chats or key in self._spill
+
+    def keys(self, prefix: str = "") -> List[str]:
+        '''
+        keys of chats in memory or spill store, starting with prefix
+        '''
+        with self._lock:
+            keys = [x for x in self._chats if x.startswith(prefix)]
+            keys += [x for x in self._spill.names() if x.startswith(prefix) and x not in self._chats]
+        return keys
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def get(self, key: str, loader: Callable[[Dict], Dict]) -> Optional[Dict]:
+        '''
+        get chat of key, chats evicted to spill store are built by `loader` from the format of `ChatBox.to_dict`.
+        '''
+        with self._lock:
+            chat = self._chats.get(key)
+            if chat is None:
+                if (raw := self._spill.load(key)) is None:
+                    return None
+                chat = loader(raw)
+                self._spill.delete(key)
+                self._add(key, chat)
+            else:
+                self._chats.move_to_end(key)
+            self._accessed[key] = time.monotonic()
+            self._maybe_evict()
+            return chat
+
+    def peek(self, key: str) -> Optional[Dict]:
+        '''
+        get chat only if it is in memory, without loading or updating LRU order.
+        '''
+        return self._chats.get(key)
+
+    def put(self, key: str, chat: Dict) -> None:
+        with self._lock:
+            self._remove(key)
+            self._spill.delete(key)
+            self._add(key, chat)
+            self._accessed[key] = time.monotonic()
+            self._maybe_evict(force=True)
+
+    def pin(self, key: str, owner: str) -> None:
+        '''
+        keep chat in memory until `owner` is released or idle for `idle_seconds`, it can be pinned before it is put.
+        '''
+        with self._lock:
+            keys, _ = self._owners.get(owner, (set(), 0))
+            if key not in keys:
+                keys.add(key)
+                self._pins[key] = self._pins.get(key, 0) + 1
+            self._owners[owner] = (keys, time.monotonic())
+
+    def release(self, owner: str) -> None:
+        '''
+        unpin all chats pinned by `owner`
+        '''
+        with self._lock:
+            keys, _ = self._owners.pop(owner, (set(), 0))
+            for key in keys:
+                if (count := self._pins.get(key, 0) - 1) > 0:
+                    self._pins[key] = count
+                else:
+                    self._pins.pop(key, None)
+
+    def touch(self, key: str) -> None:
+        '''
+        mark chat as changed, its size is estimated again at next eviction check.
+        '''
+        with self._lock:
+            if key in self._chats:
+                self._stale.add(key)
+
+    def pop(self, key: str) -> Optional[Dict]:
+        '''
+        remove chat from memory and spill store, return it if it was in memory.
+        '''
+        with self._lock:
+            chat = self._chats.get(key)
+            self._remove(key)
+            self._spill.delete(key)
+            return chat
+
+    def _add(self, key: str, chat: Dict) -> None:
+        self._chats[key] = chat
+        self._sizes[key] = estimate_size(chat)
+        self._total += self._sizes[key]
+
+    def _remove(self, key: str) -> None:
+        if key in self._chats:
+            del self._chats[key]
+            self._total -= self._sizes.pop(key)
+            self._accessed.pop(key, None)
+            self._stale.discard(key)
+
+    def _maybe_evict(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_check < self._check_interval:
+            return
+        self._last_check = now
+
+        for key in self._stale:
+            if key in self._chats:
+                size = estimate_size(self._chats[key])
+                self._total += size - self._sizes[key]
+                self._sizes[key] = size
+        self._stale.clear()
+
+        # owners such as closed sessions, which never run again
+        for owner, (_, pinned) in list(self._owners.items()):
+            if now - pinned >= self._idle_seconds:
+                self.release(owner)
+
+        for key in list(self._chats):
+            # keep the most recently used chat in memory anyway
+            if len(self._chats) <= 1:
+                break
+            if key in self._pins:
+                continue
+            if self._total <= self._max_bytes and now - self._accessed.get(key, now) < self._idle_seconds:
+                continue
+            self.evict(key)
+
+    def evict(self, key: str) -> None:
+        '''
+        write chat to spill store and drop it from memory, pinned chats are kept.
+        '''
+        with self._lock:
+            chat = self._chats.get(key)
+            if chat is None or key in self._pins:
+                return
+            # metadata may keep callbacks, such as feedback_kwargs, which can not be saved
+            history = [storable_message(dump_value(msg)) for msg in chat["history"]]
+            self._spill.write(key, dump_value(chat["context"]), dict(enumerate(history)), len(history))
+            self._remove(key)
@@ -2,17 +2,113 @@ import json
 from typing import *
 import streamlit as st
 from streamlit.delta_generator import DeltaGenerator
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import uuid
+import weakref
+from streamlit_chatbox.blobs import BlobRef, BlobStore, BLOB_PREFIX, MEDIA_OUTPUT_METHODS
+from streamlit_chatbox.metrics import instrument
 # from pydantic import BaseModel, Field
 
 
 CUSTOM_OUTPUT_METHODS = {}
+# bumped when CUSTOM_OUTPUT_METHODS changes, to invalidate cached render plans
+_output_methods_version = 0
+# render plans of elements without explicit kwargs, {(class, output method, native): (callable, kwargs)}
+_shared_plans = {}
+# output methods of text content, richmd methods render Markdown elements when use_rich_markdown is enabled
+TEXT_OUTPUT_METHODS = ["markdown", "text", "richmd", "richmd_hack"]
+RICH_MARKDOWN_KWARGS = ("theme_color", "mermaid_theme_CSS", "key")
+# key of render states in st.session_state
+RENDER_STATES_KEY = "_chatbox_render_states"
+# render states of elements rendered without a script run context
+_detached_render_states = weakref.WeakKeyDictionary()
+
+
+def _rendered_bytes(element: "OutputElement") -> Dict[str, int]:
+    content = element._content
+    if isinstance(content, str):
+        return {"bytes": len(content.encode("utf-8"))}
+    elif isinstance(content, bytes):
+        return {"bytes": len(content)}
+    return {}
+
+
+def register_output_method(name: str, func: Callable) -> None:
+    global _output_methods_version
+    CUSTOM_OUTPUT_METHODS[name] = func
+    _output_methods_version += 1
+    _shared_plans.clear()
+
+
+def _content_key(content: Any) -> Any:
+    '''
+    cheap key to tell whether content changed, hashes of str and bytes are cached by python.
+    '''
+    if isinstance(content, BlobRef):
+        return content.digest
+    try:
+        return hash(content)
+    except TypeError: # such as dict of Json
+        return id(content)
+
+
+def default_tokenizer(text: str) -> int:
+    '''
+    rough token count without any tokenizer dependency: about 4 characters per token.
+    '''
+    return (len(text) + 3) // 4
+
+
+class _FrozenDict(dict):
+    '''
+    read only dict shared by elements without explicit kwargs.
+    '''
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("shared kwargs are read only, use Element._set_kwargs instead.")
+
+    __setitem__ = __delitem__ = setdefault = pop = popitem = update = clear = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+_EMPTY_KWARGS = _FrozenDict()
+
+
+class _RenderState:
+    '''
+    what an element rendered in a session: place holder, inner slot of the status container and its
+    (title, expanded, state), output dg and signature of last render.
+    it is kept out of elements, since elements may be shared by sessions through HistoryCache.
+    '''
+    __slots__ = ("place_holder", "content_slot", "status_state", "dg", "render_sig")
+
+    def __init__(self) -> None:
+        self.place_holder = None
+        self.content_slot = None
+        self.status_state = None
+        self.dg = None
+        self.render_sig = None
+
+
+def _render_states() -> "weakref.WeakKeyDictionary[Element, _RenderState]":
+    '''
+    render states of elements in current session, they are dropped with the session or the element.
+    '''
+    if get_script_run_ctx() is None:
+        return _detached_render_states
+    states = st.session_state.get(RENDER_STATES_KEY)
+    if states is None:
+        states = st.session_state[RENDER_STATES_KEY] = weakref.WeakKeyDictionary()
+    return states
 
 
 class Element:
     '''
     wrapper of streamlit component to make them suitable for chat history.
     '''
+    __slots__ = ("_output_method", "_metadata", "_kwargs", "__weakref__")
+
     _default_kwargs = {
         "markdown": {
             "unsafe_allow_html": True,
@@ -31,47 +127,73 @@ class Element:
     def __init__(self,
                  *,
                  output_method: str = "markdown",
-                 metadata: Dict = {},
+                 metadata: Dict = None,
                  **kwargs: Any,
                  ) -> None:
         self._output_method = output_method
-        self._metadata = metadata
-        self._kwargs = kwargs
-        self._set_default_kwargs()
-        self._dg = None
-        self._place_holder = None
-
-    def _set_default_kwargs(self) -> None:
+        self._metadata = metadata or None
+        self._kwargs = kwargs or _EMPTY_KWARGS
+
+    def _set_kwargs(self, **kwargs: Any) -> None:
+        if kwargs:
+            self._kwargs = {**self._kwargs, **kwargs}
+
+    def _pop_kwargs(self, *keys: str) -> None:
+        if any(k in self._kwargs for k in keys):
+            self._kwargs = {k: v for k, v in self._kwargs.items() if k not in keys} or _EMPTY_KWARGS
+
+    def _render_kwargs(self) -> Dict:
+        '''
+        explicit kwargs merged with default kwargs of the output method.
+        defaults are not stored per element.
+        '''
         if default := self._default_kwargs.get(self._output_method):
-            for k, v in default.items():
-                self._kwargs.setdefault(k, v)
+            return {**default, **self._kwargs}
+        return self._kwargs
+
+    def _render_state(self) -> _RenderState:
+        states = _render_states()
+        state = states.get(self)
+        if state is None:
+            state = states[self] = _RenderState()
+        return state
 
     def __call__(self, render_to: DeltaGenerator=None) -> DeltaGenerator:
         # assert self._dg is None, "Every element can be rendered once only."
         render_to = render_to or st
-        self._place_holder = render_to.empty()
+        state = self._render_state()
+        state.place_holder = render_to.empty()
         output_method = getattr(st, self._output_method, CUSTOM_OUTPUT_METHODS.get(self._output_method))
         assert callable(
             output_method), f"The attribute st.{self._output_method} or {self._output_method} is not callable."
-        with self._place_holder:
-            self._dg = output_method(self._content, **self._kwargs)
+        with state.place_holder:
+            state.dg = output_method(self._content, **self._render_kwargs())
 
-        return self._dg
+        return state.dg
 
     @property
     def dg(self) -> DeltaGenerator:
-        return self._dg
+        state = _render_states().get(self)
+        return state.dg if state else None
 
     @property
     def place_holder(self) -> DeltaGenerator:
-        return self._place_holder
+        state = _render_states().get(self)
+        return state.place_holder if state else None
 
     @property
     def metadata(self) -> Dict:
+        if self._metadata is None:
+            self._metadata = {}
         return self._metadata
 
 
 class OutputElement(Element):
+    __slots__ = ("_content", "_title", "_in_expander", "_expanded", "_state", "_token_cache", "_plan")
+
+    _attrs = ("_content", "_output_method", "_kwargs", "_metadata",
+              "_title", "_in_expander", "_expanded", "_state",)
+
     def __init__(self,
                  content: Union[str, bytes] = "",
                  output_method: str = "markdown",
@@ -87,8 +209,9 @@ class OutputElement(Element):
         self._in_expander = in_expander
         self._expanded = expanded
         self._state = state
-        self._attrs = ["_content", "_output_method", "_kwargs", "_metadata",
-                       "_title", "_in_expander", "_expanded", "_state",]
+        self._token_cache = None
+        # cached (kwargs, output_method, native, version, callable, render kwargs), only for explicit kwargs
+        self._plan = None
 
     def clone(self) -> "OutputElement":
         obj = type(self)()
@@ -100,24 +223,49 @@ class OutputElement(Element):
     def content(self) -> Union[str, bytes]:
         return self._content
 
+    def count_tokens(self, tokenizer: Callable[[str], Any] = default_tokenizer) -> int:
+        '''
+        count tokens of text content with `tokenizer`, which returns a count or a list of tokens.
+        the count is cached for the tokenizer object until the content changes.
+        '''
+        if self._output_method not in TEXT_OUTPUT_METHODS or not isinstance(self._content, str):
+            return 0
+        cache = self._token_cache
+        # bound methods are created at every attribute access, they are equal if bound to the same object
+        if cache is not None and (cache[0] is tokenizer or cache[0] == tokenizer) and cache[1] is self._content:
+            return cache[2]
+        count = tokenizer(self._content)
+        if not isinstance(count, int):
+            count = len(count)
+        self._token_cache = (tokenizer, self._content, count)
+        return count
+
     def __repr__(self) -> str:
         method = self._output_method.capitalize()
         return f"{method} Element:\n{self.content}"
 
     def to_dict(self) -> Dict:
+        content = self._content
+        if isinstance(content, BlobRef):
+            content = content.uri
         return {
-            "content": self._content,
+            "content": content,
             "output_method": self._output_method,
             "title": self._title,
             "in_expander": self._in_expander,
             "expanded": self._expanded,
             "state": self._state,
-            "metadata": self._metadata,
-            "kwargs": self._kwargs,
+            "metadata": self._metadata or {},
+            "kwargs": dict(self._kwargs),
         }
 
     @classmethod
-    def from_dict(cls, d: Dict) -> "OutputElement":
+    def from_dict(cls, d: Dict, blob_store: BlobStore = None) -> "OutputElement":
+        '''
+        create element from dict exported by `to_dict`.
+        content of media elements like "blob:sha256:..." is restored as reference of `blob_store`
+        if provided and the payload exists in it, other contents are kept as is.
+        '''
         cls_maps = {
             "markdown": Markdown,
             "image": Image,
@@ -126,8 +274,20 @@ class OutputElement(Element):
         }
 
         factory_cls = cls_maps.get(d.get("output_method"), cls)
+        content = d.get("content")
+        if (blob_store is not None
+            and d.get("output_method") in MEDIA_OUTPUT_METHODS
+            and isinstance(content, str)
+            and content.startswith(BLOB_PREFIX)):
+            try:
+                ref = blob_store.ref(content)
+            except ValueError: # not a sha256 digest, keep it as plain string
+                ref = None
+            if ref is not None and ref.digest in blob_store:
+                blob_store.incref(ref.digest)
+                content = ref
         kwargs = dict(
-            content=d.get("content"),
+            content=content,
             title=d.get("title"),
             in_expander=d.get("in_expander"),
             expanded=d.get("expanded"),
@@ -140,29 +300,99 @@ class OutputElement(Element):
 
         return factory_cls(**kwargs)
 
-    def __call__(self, render_to: Optional[DeltaGenerator]=None, direct: bool=False) -> DeltaGenerator:
+    def _output(self, native: bool = False) -> Tuple[Callable, Dict]:
+        '''
+        output callable and kwargs to render the element.
+        native: prefer a builtin streamlit method to custom components, used for finished messages.
+        '''
+        output_method = getattr(st, self._output_method, CUSTOM_OUTPUT_METHODS.get(self._output_method))
+        assert callable(
+            output_method), f"The attribute st.{self._output_method} or {self._output_method} is not callable."
+        return output_method, self._render_kwargs()
+
+    def _render_plan(self, native: bool = False) -> Tuple[Callable, Dict]:
+        '''
+        output callable and kwargs resolved by `_output`, cached until kwargs or output method changes.
+        kwargs are replaced instead of modified in place, so they are compared by identity.
+        plans of elements without explicit kwargs are shared by class, instead of cached per element.
+        '''
+        if self._kwargs is _EMPTY_KWARGS:
+            self._plan = None
+            key = (type(self), self._output_method, native)
+            if (shared := _shared_plans.get(key)) is None:
+                output_method, kwargs = self._output(native)
+                shared = _shared_plans[key] = (output_method, _FrozenDict(kwargs))
+            return shared
+
+        plan = self._plan
+        if (plan is None
+            or plan[0] is not self._kwargs
+            or plan[1] != self._output_method
+            or plan[2] != native
+            or plan[3] != _output_methods_version):
+            output_method, kwargs = self._output(native)
+            plan = (self._kwargs, self._output_method, native, _output_methods_version, output_method, kwargs)
+            self._plan = plan
+        return plan[4], plan[5]
+
+    def _signature(self, native: bool = False) -> Tuple:
+        '''
+        what is sent to the frontend by rendering the element
+        '''
+        return (_content_key(self._content), self._kwargs, self._output_method, native,
+                self._in_expander, self._title, self._expanded, self._state)
+
+    @property
+    def unchanged(self) -> bool:
+        '''
+        whether rendering the element again sends the same content as its last render in current session.
+        '''
+        state = _render_states().get(self)
+        return (state is not None
+                and state.render_sig is not None
+                and state.render_sig == self._signature(state.render_sig[3]))
+
+    @instrument("render", _rendered_bytes)
+    def __call__(
+        self,
+        render_to: Optional[DeltaGenerator]=None,
+        direct: bool=False,
+        native: bool=False,
+    ) -> DeltaGenerator:
+        state = self._render_state()
         if render_to is None:
-            if self._place_holder is None:
-                self._place_holder = st.empty()
+            if state.place_holder is None:
+                state.place_holder = st.empty()
         else:
             if direct:
-                self._place_holder = render_to
+                state.place_holder = render_to
             else:
-                self._place_holder = render_to.empty()
-        temp_dg = self._place_holder
+                state.place_holder = render_to.empty()
+        temp_dg = state.place_holder
 
         if self._in_expander:
-            temp_dg = self._place_holder.status(self._title, expanded=self._expanded, state=self._state)
+            status_state = (self._title, self._expanded, self._state)
+            if not direct or state.content_slot is None or state.status_state != status_state:
+                status = state.place_holder.status(self._title, expanded=self._expanded, state=self._state)
+                state.content_slot = status.empty()
+                state.status_state = status_state
+            # the status container is kept if unchanged, only content is replaced
+            temp_dg = state.content_slot
+        else:
+            state.content_slot = None
+            state.status_state = None
         # output_method = getattr(self._place_holder, self._output_method, globals().get(self._output_method))
         # output_method = getattr(temp_dg, self._output_method)
         # self._dg = output_method(self._content, **self._kwargs)
-        output_method = getattr(st, self._output_method, CUSTOM_OUTPUT_METHODS.get(self._output_method))
-        assert callable(
-            output_method), f"The attribute st.{self._output_method} or {self._output_method} is not callable."
+        output_method, kwargs = self._render_plan(native)
+        content = self._content
+        if isinstance(content, BlobRef):
+            content = content.resolve()
         with temp_dg:
-            self._dg = output_method(self._content, **self._kwargs)
+            state.dg = output_method(content, **kwargs)
+        state.render_sig = self._signature(native)
 
-        return self._dg
+        return state.dg
 
     def update_element(
         self,
@@ -171,8 +401,15 @@ class OutputElement(Element):
         title: str = None,
         expanded: bool = None,
         state: bool = None,
+        render: bool = True,
     ) -> DeltaGenerator:
-        assert self.place_holder is not None, f"You must render the element {self} before setting new element."
+        '''
+        render `element` (or self) to the place holder of self.
+        if render is False, only status attributes and place holder are transfered, the frontend is untouched.
+        '''
+        render_state = _render_states().get(self)
+        assert render_state is not None and render_state.place_holder is not None, \
+            f"You must render the element {self} before setting new element."
         attrs = {}
         if title is not None:
             attrs["_title"] = title
@@ -183,14 +420,24 @@ class OutputElement(Element):
 
         if element is None:
             element = self
-        elif key := self._kwargs.get("key"):
-            element._kwargs["key"] = key
+        else:
+            if key := self._kwargs.get("key"):
+                element._set_kwargs(key=key)
+            target = element._render_state()
+            target.content_slot = render_state.content_slot
+            target.status_state = render_state.status_state
 
         for k, v in attrs.items():
             setattr(element, k, v)
-        
-        element(self.place_holder, direct=True)
-        return self._dg
+
+        if not render:
+            if element is not self:
+                target.place_holder = render_state.place_holder
+                target.dg = render_state.dg
+            return render_state.dg
+
+        element(render_state.place_holder, direct=True)
+        return render_state.dg
 
     def status_from(self, target: "OutputElement"):
         for attr in ["_in_expander", "_expanded", "_title", "_state"]:
@@ -198,10 +445,12 @@ class OutputElement(Element):
 
 
 class InputElement(Element):
-    pass
+    __slots__ = ()
 
 
 class Markdown(OutputElement):
+    __slots__ = ()
+
     def __init__(
         self,
         content: Union[str, bytes] = "",
@@ -220,25 +469,32 @@ class Markdown(OutputElement):
 
     def status_from(self, target: "Markdown"):
         if self._output_method in ["richmd_hack", "richmd"]:
-            self._kwargs.setdefault("theme_color", target._kwargs.get("theme_color"))
+            if "theme_color" not in self._kwargs:
+                self._set_kwargs(theme_color=target._kwargs.get("theme_color"))
         else:
-            self._kwargs.pop("theme_color", None)
+            self._pop_kwargs("theme_color")
         return super().status_from(target)
 
+    def _output(self, native: bool = False) -> Tuple[Callable, Dict]:
+        if native and self._output_method in ["richmd_hack", "richmd"]:
+            kwargs = {k: v for k, v in self._render_kwargs().items() if k not in RICH_MARKDOWN_KWARGS}
+            return st.markdown, {**self._default_kwargs["markdown"], **kwargs}
+        return super()._output(native)
+
     def enable_rich_markdown(self, enable: bool = True, theme_color: str = None):
         if enable:
             self._output_method = "richmd"
-            self._kwargs["theme_color"] = theme_color
-            self._kwargs["mermaid_theme_CSS"] = ""
-            self._kwargs.setdefault("key", uuid.uuid4().hex)
+            self._set_kwargs(theme_color=theme_color,
+                             mermaid_theme_CSS="",
+                             key=self._kwargs.get("key") or uuid.uuid4().hex)
         else:
             self._output_method = "markdown"
-            self._kwargs.pop("theme_color", None)
-            self._kwargs.pop("mermaid_theme_CSS", None)
-            self._kwargs.pop("key", None)
+            self._pop_kwargs("theme_color", "mermaid_theme_CSS", "key")
 
 
 class Image(OutputElement):
+    __slots__ = ()
+
     def __init__(
         self,
         content: Union[str, bytes] = "",
@@ -254,6 +510,8 @@ class Image(OutputElement):
 
 
 class Audio(OutputElement):
+    __slots__ = ()
+
     def __init__(
         self,
         content: Union[str, bytes] = "",
@@ -269,6 +527,8 @@ class Audio(OutputElement):
 
 
 class Video(OutputElement):
+    __slots__ = ()
+
     def __init__(
         self,
         content: Union[str, bytes] = "",
@@ -284,6 +544,8 @@ class Video(OutputElement):
 
 
 class Json(OutputElement):
+    __slots__ = ()
+
     def __init__(
         self,
         content: Union[str, bytes, dict] = "",
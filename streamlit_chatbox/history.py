@@ -0,0 +1,126 @@
+from typing import *
+from collections.abc import MutableMapping
+
+
+class Message(MutableMapping):
+    '''
+    a history message with fixed keys: role, elements and metadata.
+    it is a compact replacement of dict, `msg["role"]`, `msg.get("metadata")` and `dict(msg)` still work.
+    '''
+    __slots__ = ("role", "elements", "_metadata")
+
+    _keys = ("role", "elements", "metadata")
+
+    def __init__(
+        self,
+        role: Literal["user", "assistant"] = "assistant",
+        elements: List = None,
+        metadata: Dict = None,
+    ) -> None:
+        self.role = role
+        self.elements = [] if elements is None else elements
+        self._metadata = metadata or None
+
+    @property
+    def metadata(self) -> Dict:
+        if self._metadata is None:
+            self._metadata = {}
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value: Dict) -> None:
+        self._metadata = value
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self._keys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        raise TypeError(f"can not delete key {key} of a message.")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def copy(self) -> Dict:
+        '''
+        shallow copy as a plain dict, like `dict.copy`, so other keys can be added to it.
+        '''
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, elements={self.elements!r}, metadata={self._metadata!r})"
+
+
+class ChatHistory(list):
+    '''
+    list of history messages, which tracks positions of user messages incrementally.
+    it behaves as a plain list, so `history[i]["role"]` and `history.append(msg)` still work.
+    appending is O(1), other mutations rebuild the index.
+    '''
+    def __init__(self, messages: Iterable[Dict] = ()) -> None:
+        super().__init__(messages)
+        self._reindex()
+
+    def _reindex(self) -> None:
+        self._user_index = [i for i, msg in enumerate(self) if msg["role"] == "user"]
+
+    def append(self, msg: Dict) -> None:
+        super().append(msg)
+        if msg["role"] == "user":
+            self._user_index.append(len(self) - 1)
+
+    def extend(self, messages: Iterable[Dict]) -> None:
+        for msg in messages:
+            self.append(msg)
+
+    def __iadd__(self, messages: Iterable[Dict]) -> "ChatHistory":
+        self.extend(messages)
+        return self
+
+    def _mutating(name: str) -> Callable:
+        method = getattr(list, name)
+        def func(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            self._reindex()
+            return result
+        func.__name__ = name
+        return func
+
+    insert = _mutating("insert")
+    pop = _mutating("pop")
+    remove = _mutating("remove")
+    clear = _mutating("clear")
+    sort = _mutating("sort")
+    reverse = _mutating("reverse")
+    __setitem__ = _mutating("__setitem__")
+    __delitem__ = _mutating("__delitem__")
+    del _mutating
+
+    def __reduce_ex__(self, protocol):
+        return (type(self), (list(self),))
+
+    @property
+    def user_count(self) -> int:
+        return len(self._user_index)
+
+    def turn_start(self, turns: int) -> int:
+        '''
+        position of the first message of the last `turns` conversation turns. a turn starts with a user message.
+        '''
+        if turns <= 0:
+            return len(self)
+        if turns > len(self._user_index):
+            return 0
+        return self._user_index[-turns]
+
+    def last_turns(self, turns: int) -> List[Dict]:
+        return self[self.turn_start(turns):]
@@ -1,9 +1,18 @@
 from streamlit_chatbox.elements import *
-from streamlit_feedback import streamlit_feedback
-from functools import partial
+from streamlit_chatbox.history import ChatHistory, Message
+from streamlit_chatbox.blobs import BlobStore, BlobRef, MEDIA_OUTPUT_METHODS, BLOB_PREFIX
+from streamlit_chatbox.serialization import dump_value, LineStream, dump_binary, BinaryReader
+from streamlit_chatbox.storage import ChatStore, SQLiteChatStore, storable_message
+from streamlit_chatbox.cache import HistoryCache, estimate_size
+from streamlit_chatbox.streaming import Producer
+from streamlit_chatbox.metrics import instrument
+from streamlit_chatbox.search import SearchIndex
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from functools import partial, lru_cache
+from collections import deque
+import os
 import time
 import inspect
-import simplejson as json
 
 
 # main concept：
@@ -22,6 +31,9 @@ POSSIBLE_SCORES = {
     "faces": ["😞", "🙁", "😐", "🙂", "😀"],
 }
 
+# messages loaded at a time when exporting chats from backend
+BACKEND_PAGE_SIZE = 256
+
 
 # # patch streamlit to use streamlit-markdown (not work)
 # from streamlit_markdown import st_markdown
@@ -45,6 +57,54 @@ class AttrDict(dict):
             raise AttributeError(key)
 
 
+def default_summarizer(messages: List[Message]) -> str:
+    '''
+    summary without llm: the previous summary followed by the beginning of every user message.
+    '''
+    lines = []
+    for msg in messages:
+        text = " ".join(x.content for x in msg["elements"] if isinstance(x.content, str)).strip()
+        if msg["metadata"].get("summary"):
+            lines += text.splitlines()[1:]
+        elif msg["role"] == "user" and text:
+            lines.append(f"- {text[:80]}")
+    return "\n".join(["**earlier conversation**", *lines])
+
+
+_MISSING = object()
+
+
+def _same_value(a: Any, b: Any) -> bool:
+    '''
+    values are same if identical, or equal for simple immutable types. large objects are never compared by value.
+    '''
+    return a is b or (type(a) is type(b) and type(a) in (str, int, float, bool, bytes) and a == b)
+
+
+def _message_texts(msg: Union[Message, Dict]) -> Dict[int, str]:
+    '''
+    {element_index: content} of text elements in a message or its dict
+    '''
+    texts = {}
+    for i, e in enumerate(msg["elements"]):
+        if isinstance(e, dict):
+            output_method, content = e.get("output_method"), e.get("content")
+        else:
+            output_method, content = e._output_method, e._content
+        if output_method in TEXT_OUTPUT_METHODS and isinstance(content, str):
+            texts[i] = content
+    return texts
+
+
+def _history_length(box: "ChatBox") -> Dict[str, int]:
+    return {"history_length": len(box.history)}
+
+
+def _session_id() -> str:
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "default"
+
+
 class ChatBox:
     def __init__(
         self,
@@ -56,7 +116,47 @@ class ChatBox:
         user_theme: str = "green",
         assistant_theme: str = "blue",
         greetings: Union[str, OutputElement, List[Union[str, OutputElement]]] = [],
+        stream_interval: float = 0,
+        stream_min_chars: int = 0,
+        window_size: int = 0,
+        page_size: int = 20,
+        use_fragment: bool = False,
+        tokenizer: Callable[[str], Any] = default_tokenizer,
+        blob_store: BlobStore = None,
+        backend: ChatStore = None,
+        flush_interval: float = 1,
+        history_cache: HistoryCache = None,
+        cache_namespace: str = None,
+        native_history: bool = False,
+        compact_max_messages: int = 0,
+        compact_max_bytes: int = 0,
+        compact_max_tokens: int = 0,
+        summarizer: Callable[[List[Message]], Union[str, OutputElement, List[OutputElement]]] = None,
+        archive_store: ChatStore = None,
     ) -> None:
+        '''
+        stream_interval: when streaming, flush updates to the frontend at most once every `stream_interval` seconds.
+        stream_min_chars: when streaming, flush updates once at least `stream_min_chars` characters are buffered.
+        updates are always flushed when `streaming` is False. both 0 means flushing on every update.
+        window_size: render only the last `window_size` messages in `output_messages`, 0 means all.
+        page_size: how many earlier messages to show when clicking "load earlier messages".
+        use_fragment: render every message of `output_messages` in a st.fragment, so widgets inside a message (e.g. feedback) rerun that message only.
+        tokenizer: default tokenizer of `filter_history(max_tokens=...)`, returns a count or a list of tokens for text.
+        blob_store: if provided, bytes content of image/audio/video elements is saved to the store and kept as reference in history.
+        backend: persistent storage of chats, such as SQLiteChatStore. chats are loaded when accessed and changed messages are written in batches.
+        flush_interval: write changes to backend at most once every `flush_interval` seconds, call `flush` to write immediately.
+        history_cache: process wide HistoryCache to keep chats, st.session_state only keeps handles of them.
+        cache_namespace: chats with the same namespace and name are shared in history_cache, such as tabs of the same user. default to the session id.
+        native_history: render rich markdown of history messages with st.markdown in `output_messages`,
+            only messages added or updated in current run use the rich markdown component.
+        compact_max_messages/compact_max_bytes/compact_max_tokens: when history of current chat exceeds any of them,
+            older turns are replaced by a summary message at the start of `output_messages`, 0 means no limit.
+        summarizer: called with messages to be compacted (including the previous summary), returns summary text or elements.
+            default to a list of the beginning of user messages.
+        archive_store: ChatStore to save raw messages replaced by summaries, default to keep them in session memory.
+            archived messages are shown by "show archived messages" and included by exports.
+            it is required to compact chats when backend or history_cache is set, since they only keep history and context.
+        '''
         self._chat_name = chat_name
         self._chat_containers = []
         self._session_key = session_key
@@ -71,6 +171,32 @@ class ChatBox:
             if isinstance(greeting, str):
                 greetings[i] = Markdown(greeting)
         self._greetings = greetings
+        self._stream_interval = stream_interval
+        self._stream_min_chars = stream_min_chars
+        self._stream_flushed = {}
+        self._window_size = window_size
+        self._page_size = page_size
+        self._use_fragment = use_fragment
+        self._tokenizer = tokenizer
+        self._blob_store = blob_store
+        self._backend = backend
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._history_cache = history_cache
+        self._cache_namespace = cache_namespace
+        # chats pinned by the previous run of the session are released when the script runs again
+        self._pin_owner = f"{_session_id()}/{session_key}"
+        if history_cache is not None:
+            history_cache.release(self._pin_owner)
+        self._native_history = native_history
+        self._render_report = {"reused": 0, "resent": 0}
+        self._compact_max_messages = compact_max_messages
+        self._compact_max_bytes = compact_max_bytes
+        self._compact_max_tokens = compact_max_tokens
+        self._summarizer = summarizer or default_summarizer
+        self._archive_store = archive_store
+        if compact_max_messages or compact_max_bytes or compact_max_tokens:
+            self._check_archive_store()
 
     @staticmethod
     def register_output_method(name: str, func: Callable):
@@ -78,7 +204,7 @@ class ChatBox:
         register a custom output method, such as thirdpart component.
         Use it as OutputElement(output_method=name, *args, **kwds) as Mardown()
         '''
-        CUSTOM_OUTPUT_METHODS[name] = func
+        register_output_method(name, func)
 
     @property
     def chat_inited(self):
@@ -86,7 +212,20 @@ class ChatBox:
 
     def init_session(self, clear: bool =False):
         if not self.chat_inited or clear:
+            if self.chat_inited:
+                for chat in st.session_state[self._session_key].values():
+                    if "handle" in chat:
+                        chat = self._history_cache.pop(chat["handle"]) or {}
+                    self._release_history(chat.get("history", []))
             st.session_state[self._session_key] = {}
+            st.session_state.pop(self._search_key, None)
+            if clear and self._backend is not None:
+                self._backend.clear()
+            if clear and self._archive_store is not None:
+                self._archive_store.clear()
+            elif not clear and self._has_chat(self._chat_name):
+                # restore from history_cache or backend
+                return
             time.sleep(0.1)
             self.reset_history(self._chat_name)
 
@@ -95,42 +234,237 @@ class ChatBox:
             st.session_state[self._session_key] = {}
 
         name = name or self.cur_chat_name
+        chat = self._get_chat(name) or {}
+        self._release_history(chat.get("history", []))
         if keep_context:
-            context = st.session_state[self._session_key].get(name, {}).get("context", AttrDict())
+            context = chat.get("context", AttrDict())
         else:
             context = AttrDict()
-        st.session_state[self._session_key][name] = {"history": [], "context": context}
+        chat = {"history": ChatHistory(), "context": context}
         if self._greetings:
-            st.session_state[self._session_key][name]["history"] = [{
-                    "role": "assistant",
-                    "elements": self._greetings,
-                    "metadata": {},
-            }]
+            chat["history"].append(Message("assistant", self._greetings))
+        self._set_chat(name, chat)
+        self._mark_dirty(None, name)
 
     def use_chat_name(self, name: str = "default") -> None:
         self.init_session()
+        if self._backend is not None and name != self._chat_name:
+            # keep only the current chat in memory, others can be loaded from backend again
+            self.flush()
+            st.session_state[self._session_key].pop(self._chat_name, None)
         self._chat_name = name
-        if name not in st.session_state[self._session_key]:
+        if not self._has_chat(name):
             self.reset_history(name)
 
     def change_chat_name(self, new_name: str, origin_name: str = None) -> bool:
         self.init_session()
         origin_name = origin_name or self.cur_chat_name
-        if (origin_name in st.session_state[self._session_key]
-            and new_name not in st.session_state[self._session_key]):
-            st.session_state[self._session_key][new_name] = st.session_state[self._session_key].pop(origin_name)
+        if self._has_chat(origin_name) and not self._has_chat(new_name):
+            self._set_chat(new_name, self._pop_chat(origin_name))
+            if self._backend is not None:
+                self.flush()
+                self._backend.rename(origin_name, new_name)
+            if self._archive_store is not None:
+                self._archive_store.rename(origin_name, new_name)
+            if (state := st.session_state.get(self._search_key)) is not None:
+                state["index"].rename_chat(origin_name, new_name)
+                state["pending"] = {(new_name if n == origin_name else n, i) for n, i in state["pending"]}
             self._chat_name = new_name
 
     def del_chat_name(self, name: str):
         self.init_session()
-        if name in st.session_state[self._session_key]:
-            msgs = st.session_state[self._session_key].pop(name)
+        if self._has_chat(name):
+            msgs = self._pop_chat(name)
+            self._release_history(msgs["history"])
+            if self._backend is not None:
+                self._backend.delete(name)
+            if self._archive_store is not None:
+                self._archive_store.delete(name)
+            if (state := st.session_state.get(self._search_key)) is not None:
+                state["pending"].add((name, None))
             self._chat_name=self.get_chat_names()[0]
         return msgs
 
     def get_chat_names(self):
         self.init_session()
-        return list(st.session_state[self._session_key].keys())
+        names = list(st.session_state[self._session_key].keys())
+        if self._backend is not None:
+            # chats are ordered as they are created in backend, new chats not written yet follow
+            stored = self._backend.names()
+            stored_set = set(stored)
+            names = stored + [x for x in names if x not in stored_set]
+        if self._history_cache is not None:
+            prefix = self._cache_key("")
+            names += [x[len(prefix):] for x in self._history_cache.keys(prefix) if x[len(prefix):] not in names]
+        return names
+
+    def _has_chat(self, name: str) -> bool:
+        return (name in st.session_state[self._session_key]
+                or (self._history_cache is not None and self._cache_key(name) in self._history_cache)
+                or (self._backend is not None and name in self._backend))
+
+    def _get_chat(self, name: str) -> Optional[Dict]:
+        '''
+        get the chat dict of `name`, materialize it if it was loaded lazily by `from_dict` or is stored in backend.
+        '''
+        chats = st.session_state[self._session_key]
+        chat = chats.get(name)
+        if (chat is None
+            and self._history_cache is not None
+            and (key := self._cache_key(name)) in self._history_cache):
+            # shared by other sessions
+            chats[name] = chat = {"handle": key}
+        if chat is None and self._backend is not None:
+            if (raw := self._backend.load(name)) is not None:
+                chat = self._load_chat(raw)
+                self._set_chat(name, chat)
+        elif chat is not None and "raw" in chat:
+            chat = self._load_chat(chat["raw"])
+            self._set_chat(name, chat)
+        if chat is not None and "handle" in chat:
+            self._pin(chat["handle"])
+            chat = self._history_cache.get(chat["handle"], self._load_chat)
+        return chat
+
+    def _set_chat(self, name: str, chat: Dict) -> None:
+        '''
+        save chat dict to session, or to history_cache and keep its handle in session.
+        '''
+        if self._history_cache is None:
+            st.session_state[self._session_key][name] = chat
+        else:
+            key = self._cache_key(name)
+            self._pin(key)
+            self._history_cache.put(key, chat)
+            st.session_state[self._session_key][name] = {"handle": key}
+
+    def _pin(self, key: str) -> None:
+        '''
+        keep chat in history_cache until the next run of the session, so elements held by current run are not orphaned.
+        '''
+        self._history_cache.pin(key, self._pin_owner)
+
+    def _pop_chat(self, name: str) -> Optional[Dict]:
+        '''
+        remove chat from session and history_cache, return the materialized chat dict.
+        '''
+        chat = self._get_chat(name)
+        entry = st.session_state[self._session_key].pop(name, {})
+        if "handle" in entry:
+            self._history_cache.pop(entry["handle"])
+        return chat
+
+    def _cache_key(self, name: str) -> str:
+        namespace = self._cache_namespace
+        if namespace is None:
+            namespace = _session_id()
+        return f"{namespace}/{self._session_key}/{name}"
+
+    def _load_chat(self, data: Dict) -> Dict:
+        '''
+        build chat dict from the format of `to_dict`
+        '''
+        history = ChatHistory(Message(
+            h["role"],
+            [OutputElement.from_dict(x, self._blob_store) for x in h["elements"]],
+            h["metadata"],
+        ) for h in data["history"])
+        chat = {"history": history, "context": AttrDict(data["context"])}
+        if data.get("archive"):
+            chat["archive"] = list(data["archive"])
+        return chat
+
+    def _raw_chat(self, name: str) -> Optional[Dict]:
+        '''
+        chat in the format of `to_dict` if it is not materialized in this session:
+        kept raw by `from_dict`, or stored in backend only. return None for other chats.
+        '''
+        chat = st.session_state[self._session_key].get(name)
+        if chat is not None:
+            return chat.get("raw")
+        if self._in_backend_only(name):
+            return self._backend.load(name)
+        return None
+
+    def _in_backend_only(self, name: str) -> bool:
+        '''
+        whether chat is neither in session nor history_cache, and can only be read from backend.
+        '''
+        return (self._backend is not None
+                and name not in st.session_state[self._session_key]
+                and (self._history_cache is None or self._cache_key(name) not in self._history_cache))
+
+    def _iter_backend_messages(self, name: str) -> Iterator[Dict]:
+        '''
+        messages of chat in backend, loaded by pages of BACKEND_PAGE_SIZE
+        '''
+        for start in range(0, self._backend.count(name), BACKEND_PAGE_SIZE):
+            yield from self._backend.load(name, start, start + BACKEND_PAGE_SIZE)["history"]
+
+    def _dump_chat(self, name: str) -> Dict:
+        '''
+        export chat to the format of `to_dict`, chats not materialized are returned without loading them to session.
+        '''
+        if (chat := self._raw_chat(name)) is not None:
+            data = {"history": chat["history"], "context": chat["context"]}
+        else:
+            chat = self._get_chat(name)
+            data = dump_value({"history": chat["history"], "context": chat["context"]})
+        if archive := self._archived_dicts(name, chat):
+            data["archive"] = archive
+        return data
+
+    @property
+    def _search_key(self) -> str:
+        return f"{self._session_key}_search"
+
+    @instrument("search")
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        chat_names: List[str] = None,
+    ) -> List[Tuple[str, int, int]]:
+        '''
+        full text search of text elements in all chats, return (chat_name, history_index, element_index) of best matches.
+        the index is built at the first search, then only messages changed since last search are indexed again.
+        '''
+        self.init_session()
+        state = st.session_state.get(self._search_key)
+        if state is None:
+            state = {"index": SearchIndex(), "pending": {(x, None) for x in self.get_chat_names()}}
+            st.session_state[self._search_key] = state
+
+        index: SearchIndex = state["index"]
+        pending = state["pending"]
+        while pending:
+            name, history_index = pending.pop()
+            history = self._search_history(name)
+            if history_index is None:
+                index.remove_chat(name)
+                for i, msg in enumerate(history):
+                    index.index_message(name, i, _message_texts(msg))
+            elif history_index < len(history):
+                index.index_message(name, history_index, _message_texts(history[history_index]))
+            else:
+                index.remove_message(name, history_index)
+        return [key for key, _ in index.search(query, limit, chat_names)]
+
+    def _search_history(self, name: str) -> List:
+        '''
+        messages of chat to be indexed, chats not in memory are read as dicts without materializing.
+        '''
+        if (chat := self._raw_chat(name)) is not None:
+            return chat["history"]
+        return (self._get_chat(name) or {}).get("history", [])
+
+    @property
+    def render_report(self) -> Dict[str, int]:
+        '''
+        elements rendered by the last `output_messages`:
+        "reused" elements are identical to what they sent in their last render, "resent" ones are new or changed.
+        '''
+        return dict(self._render_report)
 
     @property
     def cur_chat_name(self):
@@ -139,55 +473,88 @@ class ChatBox:
     @property
     def context(self) -> AttrDict:
         self.init_session()
-        return st.session_state[self._session_key].get(self._chat_name, {}).get("context", AttrDict())
+        return (self._get_chat(self._chat_name) or {}).get("context", AttrDict())
 
     @property
     def history(self) -> List:
         self.init_session()
-        return st.session_state[self._session_key].get(self._chat_name, {}).get("history", [])
+        return (self._get_chat(self._chat_name) or {}).get("history", [])
 
     def other_history(self, chat_name: str, default: List=[]) -> Optional[List]:
         self.init_session()
         chat_name = chat_name or self.cur_chat_name
-        return st.session_state[self._session_key].get(chat_name, {}).get("history", default)
+        return (self._get_chat(chat_name) or {}).get("history", default)
 
     def other_context(self, chat_name: str, default: AttrDict=AttrDict()) -> AttrDict:
         self.init_session()
         chat_name = chat_name or self.cur_chat_name
-        return st.session_state[self._session_key].get(chat_name, {}).get("context", default)
+        return (self._get_chat(chat_name) or {}).get("context", default)
 
-    def context_to_session(self, chat_name: str=None, include: List[str]=[], exclude: List[str]=[]) -> None:
+    def context_to_session(self, chat_name: str=None, include: List[str]=[], exclude: List[str]=[]) -> List[str]:
         '''
         copy context to st.session_state.
-        copy named variables only if `kw` specified
+        copy named variables only if `include` specified
         this can be usefull to restore session_state when you switch between chat conversations
+        only values different from st.session_state are copied, return the copied keys.
         '''
-        for k, v in self.other_context(chat_name).items():
-            if (not include or k in include
-                and k not in exclude):
-                st.session_state[k] = v
-
-    def context_from_session(self, chat_name: str=None, include: List[str]=[], exclude: List[str]=[]) -> None:
+        context = self.other_context(chat_name)
+        state = st.session_state
+        exclude = set(exclude)
+        changed = []
+        for k in (include or list(context.keys())):
+            if k in exclude or k not in context:
+                continue
+            v = context[k]
+            if not _same_value(state.get(k, _MISSING), v):
+                state[k] = v
+                changed.append(k)
+        return changed
+
+    def context_from_session(self, chat_name: str=None, include: List[str]=[], exclude: List[str]=[]) -> List[str]:
         '''
         copy context from st.session_state.
-        copy named variables only if `kw` specified
+        copy named variables only if `include` specified, then st.session_state is not scanned.
         this can be usefull to save session_state when you switch between chat conversations
+        only values changed since last sync are copied, return the copied keys.
         '''
-        for k, v in st.session_state.items():
-            if ((not include or k in include)
-                and k not in exclude
-                and k != self._session_key):
-                self.other_context(chat_name)[k] = v
-
+        self.init_session()
+        chat = self._get_chat(chat_name or self.cur_chat_name)
+        context = chat["context"]
+        state = st.session_state
+        exclude = set(exclude)
+        if include:
+            items = [(k, state[k]) for k in include if k in state]
+        else:
+            items = state.items()
+        changed = []
+        for k, v in items:
+            if (k in exclude
+                or k == self._session_key
+                or k == RENDER_STATES_KEY
+                or k.startswith(f"{self._session_key}_")): # internal states of ChatBox
+                continue
+            if not _same_value(context.get(k, _MISSING), v):
+                context[k] = v
+                changed.append(k)
+        if changed and self._backend is not None:
+            # context is written at next flush
+            chat.setdefault("dirty", set())
+        return changed
+
+    @instrument("filter_history")
     def filter_history(
         self,
         history_len: int = None,
         filter: Callable = None,
         stop: Callable = None,
         chat_name: str = None,
+        max_tokens: int = None,
+        tokenizer: Callable[[str], Any] = None,
     ) -> List:
         '''
         history_len: the length of conversation pairs
+        max_tokens: keep the latest messages whose text tokens sum up to max_tokens at most. token counts are cached on elements.
+        tokenizer: callable returns a count or a list of tokens for text, default to the tokenizer of ChatBox
         filter: custom filter fucntion with arguments (msg,) or (msg, index), return None if skipping msg. default filter returns all text/markdown content.
         stop: custom function to stop filtering with arguments (history,) history is already filtered messages, return True if stop. default stop on history_len
         '''
@@ -197,40 +564,66 @@ class ChatBox:
             '''
             filter text messages only with the format {"role":role, "content":content}
             '''
-            content = [x.content for x in msg["elements"] if x._output_method in ["markdown", "text"]]
+            content = [x.content for x in msg["elements"] if x._output_method in TEXT_OUTPUT_METHODS]
             return {
                 "role": msg["role"],
                 "content": "\n\n".join(content),
             }
 
-        def default_stop(r):
-            if isinstance(history_len, int):
-                user_count = len([x for x in r if x["role"] == "user"])
-                return user_count >= history_len
-            else:
-                return False
+        history = self.other_history(chat_name)
+        if not isinstance(history, ChatHistory):
+            history = ChatHistory(history)
 
-        if filter is None:
-            filter = default_filter
+        tokenizer = tokenizer or self._tokenizer
+        def count_tokens(msg):
+            return sum(x.count_tokens(tokenizer) for x in msg["elements"])
 
         if stop is None:
-            stop = default_stop
+            if filter is None:
+                # every message is kept, so the result is a slice from the start of last turns
+                if isinstance(history_len, int):
+                    history = history.last_turns(history_len)
+                if max_tokens is not None:
+                    start = len(history)
+                    total = 0
+                    for msg in reversed(history):
+                        total += count_tokens(msg)
+                        if total > max_tokens:
+                            break
+                        start -= 1
+                    history = history[start:]
+                return [default_filter(msg) for msg in history]
+            stop = _count_stop(history_len)
+        elif filter is None:
+            filter = default_filter
 
-        result = []
-        args_len = len(inspect.signature(filter).parameters)
-        history = self.other_history(chat_name)
+        if isinstance(stop, _count_stop):
+            result = deque()
+            prepend = result.appendleft
+        else:
+            # custom stop functions expect a list, such as `lambda r: len(r[1:]) >= 2`
+            result = []
+            prepend = partial(result.insert, 0)
+        args_len = _count_params(filter)
+        total = 0
 
-        for i, msg in enumerate(history[-1::-1]):
+        for i, msg in enumerate(reversed(history)):
             if stop(result):
                 break
+            if max_tokens is not None:
+                tokens = count_tokens(msg)
+                if total + tokens > max_tokens:
+                    break
             if args_len == 1:
                 filtered = filter(msg)
             else:
                 filtered = filter(msg, i)
             if filtered is not None:
-                result.insert(0, filtered)
+                prepend(filtered)
+                if max_tokens is not None:
+                    total += tokens
 
-        return result
+        return list(result)
 
     def export2md(
         self,
@@ -278,31 +671,23 @@ class ChatBox:
         export current state including messages and context to dict
         '''
         self.init_session()
-
-        def p(val):
-            if isinstance(val, (list, tuple)):
-                return [p(x) for x in val]
-            elif isinstance(val, dict):
-                return {k: p(v) for k, v in val.items()}
-            elif isinstance(val, OutputElement):
-                return val.to_dict()
-            else:
-                return val
-
-        histories = {x: p({"history": self.other_history(x), "context": self.other_context(x)}) for x in self.get_chat_names()}
+        histories = {x: self._dump_chat(x) for x in self.get_chat_names()}
         return {
             "cur_chat_name": self.cur_chat_name,
             "session_key": self._session_key,
             "user_avatar": self._user_avatar,
             "assistant_avatar": self._assistant_avatar,
-            "greetings": p(self._greetings),
+            "greetings": dump_value(self._greetings),
             "histories": histories,
         }
 
+    @instrument("to_json")
     def to_json(
         self,
         pretty: bool = True,
     ) -> str:
+        import simplejson as json
+
         data = self.to_dict()
         kwargs = {"ensure_ascii": False}
         if pretty:
@@ -314,29 +699,151 @@ class ChatBox:
         data: Dict,
     ) -> "ChatBox":
         '''
-        load state from dict
+        load state from dict exported by `to_dict`.
+        chats other than the current one are materialized when they are accessed at the first time.
         '''
         self._chat_name=data["cur_chat_name"]
         self._session_key=data["session_key"]
         self._user_avatar=data["user_avatar"]
         self._assistant_avatar=data["assistant_avatar"]
-        self._greetings=[OutputElement.from_dict(x) for x in data["greetings"]]
+        self._greetings=[OutputElement.from_dict(x, self._blob_store) for x in data["greetings"]]
         self.init_session(clear=True)
 
-        for name, history in data["histories"].items():
-            self.reset_history(name)
-            for h in history:
-                msg = {
-                    "role": h["history"]["role"],
-                    "elements": [OutputElement.from_dict(y) for y in h["history"]["elements"]],
-                    "metadata": h["history"]["metadata"],
-                    }
-                self.other_history(name).append(msg)
-                self.other_context(name).update(h["context"])
-
+        # only the current chat is built, others are kept as raw dict until accessed
+        st.session_state[self._session_key] = {name: {"raw": chat} for name, chat in data["histories"].items()}
+        if self._backend is not None:
+            for name, chat in data["histories"].items():
+                self._backend.write(name, chat["context"], dict(enumerate(chat["history"])), len(chat["history"]))
+        self._save_archives()
         self.use_chat_name(data["cur_chat_name"])
+        self._get_chat(self._chat_name)
         return self
 
+    def iter_jsonl(
+        self,
+        chat_names: List[str] = None,
+    ) -> Iterator[str]:
+        '''
+        export state as json lines lazily: a "chatbox" line, then a "chat" line with context for every chat followed by its "message" lines.
+        only one message is serialized at a time, chats only in backend are read page by page without loading them to session.
+        '''
+        import simplejson as json
+
+        self.init_session()
+        yield json.dumps({
+            "type": "chatbox",
+            "cur_chat_name": self.cur_chat_name,
+            "session_key": self._session_key,
+            "user_avatar": self._user_avatar,
+            "assistant_avatar": self._assistant_avatar,
+            "greetings": dump_value(self._greetings),
+        }, ensure_ascii=False) + "\n"
+
+        for name in chat_names or self.get_chat_names():
+            chat = st.session_state[self._session_key].get(name, {})
+            if "raw" in chat:
+                context, history = chat["raw"]["context"], chat["raw"]["history"]
+                archive = self._archived_dicts(name, chat["raw"])
+            elif self._in_backend_only(name):
+                context = self._backend.load(name, 0, 0)["context"]
+                history = self._iter_backend_messages(name)
+                archive = self._archived_dicts(name, {})
+            else:
+                chat = self._get_chat(name)
+                context, history = chat["context"], chat["history"]
+                archive = self._archived_dicts(name, chat)
+            yield json.dumps({"type": "chat", "name": name, "context": dump_value(context)},
+                             ensure_ascii=False) + "\n"
+            for msg in archive:
+                yield json.dumps({"type": "archived", **msg}, ensure_ascii=False) + "\n"
+            for msg in history:
+                yield json.dumps({"type": "message", **dump_value(msg)}, ensure_ascii=False) + "\n"
+
+    def export_jsonl(
+        self,
+        fp: IO = None,
+        chat_names: List[str] = None,
+    ) -> Optional[IO]:
+        '''
+        write json lines to text file `fp`.
+        if fp is None, return a lazy binary file object, which can be passed to st.download_button directly.
+        '''
+        lines = self.iter_jsonl(chat_names)
+        if fp is None:
+            return LineStream(lines)
+        for line in lines:
+            fp.write(line)
+
+    def from_jsonl(
+        self,
+        lines: Iterable[Union[str, bytes]],
+    ) -> "ChatBox":
+        '''
+        load state from json lines exported by `iter_jsonl`/`export_jsonl`, `lines` can be any iterable or file object.
+        '''
+        import simplejson as json
+
+        name = None
+        for line in lines:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            type_ = d.pop("type")
+            if type_ == "chatbox":
+                self._chat_name = d["cur_chat_name"]
+                self._session_key = d["session_key"]
+                self._user_avatar = d["user_avatar"]
+                self._assistant_avatar = d["assistant_avatar"]
+                self._greetings = [OutputElement.from_dict(x, self._blob_store) for x in d["greetings"]]
+                self.init_session(clear=True)
+                st.session_state[self._session_key] = {}
+            elif type_ == "chat":
+                name = d["name"]
+                self._set_chat(name, {
+                    "history": ChatHistory(),
+                    "context": AttrDict(d["context"]),
+                })
+            elif type_ == "archived":
+                self._get_chat(name).setdefault("archive", []).append(d)
+            elif type_ == "message":
+                self.other_history(name).append(Message(
+                    d["role"],
+                    [OutputElement.from_dict(x, self._blob_store) for x in d["elements"]],
+                    d["metadata"],
+                ))
+
+        self._save_archives()
+        if self._backend is not None:
+            for name in st.session_state[self._session_key]:
+                self._mark_dirty(None, name)
+            self.flush()
+        self.use_chat_name(self._chat_name)
+        return self
+
+    @instrument("save_binary")
+    def save_binary(
+        self,
+        fp: Union[str, os.PathLike, BinaryIO] = None,
+        compression: Literal["zlib", "zstd", None] = None,
+    ) -> Optional[bytes]:
+        '''
+        write state to file path or binary file object `fp` in the versioned binary format, return bytes if fp is None.
+        bytes contents are stored as is, and every chat is compressed independently with zlib or zstd if specified.
+        '''
+        return dump_binary(self.to_dict(), fp, compression)
+
+    @instrument("load_binary")
+    def load_binary(
+        self,
+        fp: Union[str, os.PathLike, bytes, BinaryIO],
+        chat_names: List[str] = None,
+    ) -> "ChatBox":
+        '''
+        load state saved by `save_binary`. if `chat_names` is provided, only those chats are read and decoded.
+        '''
+        with BinaryReader(fp) as reader:
+            return self.from_dict(reader.load(chat_names))
+
     def _prepare_elements(
         self,
         elements: Union[OutputElement, str, List[Union[OutputElement, str]]],
@@ -355,8 +862,47 @@ class ChatBox:
         for e in result:
             if isinstance(e, Markdown):
                 e.enable_rich_markdown(self._use_rich_markdown, theme)
+        self._store_blobs(result)
         return result
 
+    def _store_blobs(self, elements: List[OutputElement]) -> None:
+        '''
+        move bytes content of media elements to blob store
+        '''
+        if self._blob_store is None:
+            return
+        for e in elements:
+            if e._output_method in MEDIA_OUTPUT_METHODS and isinstance(e._content, bytes):
+                e._content = self._blob_store.put(e._content)
+
+    def _release_blobs(self, elements: List[OutputElement]) -> None:
+        for e in elements:
+            if isinstance(e.content, BlobRef):
+                e.content.store.decref(e.content.digest)
+
+    def _release_history(self, history: List[Dict]) -> None:
+        for msg in history:
+            self._release_blobs(msg["elements"])
+
+    def blob_digests(self) -> Set[str]:
+        '''
+        digests of blobs referenced by all chats of the session, including chats not materialized and archived messages.
+        reference counts of BlobStore only cover materialized elements, pass them to `BlobStore.gc(keep=...)`.
+        '''
+        self.init_session()
+        digests = set()
+        for name in self.get_chat_names():
+            chat = self._raw_chat(name) or self._get_chat(name) or {}
+            for msg in [*chat.get("history", []), *self._archived_dicts(name, chat)]:
+                for e in msg["elements"]:
+                    content = e.get("content") if isinstance(e, dict) else e._content
+                    if isinstance(content, BlobRef):
+                        digests.add(content.digest)
+                    elif isinstance(content, str) and content.startswith(BLOB_PREFIX):
+                        digests.add(content[len(BLOB_PREFIX):])
+        return digests
+
+    @instrument("user_say", gauges=_history_length)
     def user_say(
         self,
         elements: Union[OutputElement, str, List[Union[OutputElement, str]]] = None,
@@ -370,9 +916,11 @@ class ChatBox:
         for element in elements:
             element(render_to=chat_ele)
 
-        self.history.append({"role": "user", "elements": elements, "metadata": metadata})
+        self.history.append(Message("user", elements, metadata.copy()))
+        self._mark_dirty(-1)
         return elements
 
+    @instrument("ai_say", gauges=_history_length)
     def ai_say(
         self,
         elements: Union[OutputElement, str, List[Union[OutputElement, str]]] = None,
@@ -387,15 +935,23 @@ class ChatBox:
         for element in elements:
             element(render_to=container)
 
-        self.history.append({"role": "assistant", "elements": elements, "metadata": metadata.copy()})
+        self.history.append(Message("assistant", elements, metadata.copy()))
+        self._mark_dirty(-1)
         return elements
 
     def show_feedback(self, history_index=-1, **kwargs):
         '''
         render feedback component
         '''
-        with self._chat_containers[history_index]:
-            self.history[history_index]["metadata"]["feedback_kwargs"] = kwargs
+        self.history[history_index]["metadata"]["feedback_kwargs"] = kwargs
+        self._mark_dirty(history_index)
+        container = self._container(history_index)
+        if container is None: # message is out of the rendering window
+            return None
+        # streamlit_feedback registers its component when imported, which is slow and not needed without feedback
+        from streamlit_feedback import streamlit_feedback
+
+        with container:
             return streamlit_feedback(**kwargs)
 
     def set_feedback(self, feedback: Dict, history_index=-1) -> int:
@@ -404,28 +960,87 @@ class ChatBox:
         return the index of streamlit_feedback's emoji score
         '''
         self.history[history_index]["metadata"]["feedback"] = feedback
+        self._mark_dirty(history_index)
         score = feedback.get("score")
         for v in POSSIBLE_SCORES.values():
             if score in v:
                 return v.index(score)
 
-    def output_messages(self):
+    @instrument("output_messages", gauges=_history_length)
+    def output_messages(self, window_size: int = None, page_size: int = None):
+        '''
+        render history messages.
+        if window_size > 0, only the last messages are rendered, with a button to load earlier messages page by page.
+        '''
         self.init_session()
-        self._chat_containers = []
-        for i, msg in enumerate(self.history):
+        self.compact()
+        self.flush()
+        window_size = self._window_size if window_size is None else window_size
+        page_size = page_size or self._page_size
+        history = self.history
+        start = 0
+        if window_size:
+            chat = self._get_chat(self._chat_name)
+            window = max(chat.get("window", 0), window_size)
+            start = max(len(history) - window, 0)
+            if start > 0:
+                def load_earlier():
+                    chat["window"] = window + page_size
+                st.button(f"load earlier messages ({start})",
+                          key=f"{self._session_key}_load_earlier",
+                          on_click=load_earlier)
+
+        if history and history[0]["metadata"].get("summary"):
+            self._output_archived()
+
+        # keep containers aligned with history, None for messages out of window
+        self._chat_containers = [None] * len(history)
+        self._render_report = {"reused": 0, "resent": 0}
+        output_message = self._output_message
+        if self._use_fragment and (fragment := _get_fragment()):
+            output_message = fragment(output_message)
+        for i in range(start, len(history)):
+            msg = history[i]
             avatar = self._user_avatar if msg["role"] == "user" else self._assistant_avatar
-            chat_ele = st.chat_message(msg["role"], avatar=avatar)
-            container = chat_ele.container()
-            self._chat_containers.append(container)
-            for element in msg["elements"]:
-                element(render_to=container)
+            with st.chat_message(msg["role"], avatar=avatar):
+                output_message(i)
 
-            feedback_kwargs = msg["metadata"].get("feedback_kwargs", {})
-            if feedback_kwargs:
-                if feedback := msg["metadata"].get("feedback"):
-                    feedback_kwargs["disable_with_score"] = feedback["score"]
-                self.show_feedback(history_index=i, **feedback_kwargs)
+    def _output_archived(self) -> None:
+        '''
+        render a checkbox to show archived messages of current chat, they are rendered read only.
+        '''
+        summary = self.history[0]
+        if not st.checkbox(f"show archived messages ({summary['metadata'].get('archived', 0)})",
+                           key=f"{self._session_key}_show_archived"):
+            return
+        for msg in self.archived_history():
+            avatar = self._user_avatar if msg["role"] == "user" else self._assistant_avatar
+            with st.chat_message(msg["role"], avatar=avatar):
+                for element in msg["elements"]:
+                    element(native=self._native_history)
+
+    def _output_message(self, history_index: int):
+        '''
+        render elements and feedback of a history message to a new container.
+        '''
+        msg = self.history[history_index]
+        container = st.container()
+        self._chat_containers[history_index] = container
+        report = self._render_report
+        for element in msg["elements"]:
+            if element.unchanged:
+                report["reused"] += 1
+            else:
+                report["resent"] += 1
+            element(render_to=container, native=self._native_history)
+
+        feedback_kwargs = msg["metadata"].get("feedback_kwargs", {})
+        if feedback_kwargs:
+            if feedback := msg["metadata"].get("feedback"):
+                feedback_kwargs["disable_with_score"] = feedback["score"]
+            self.show_feedback(history_index=history_index, **feedback_kwargs)
 
+    @instrument("update_msg", gauges=_history_length)
     def update_msg(
         self,
         element: Union["OutputElement", str] = None,
@@ -451,19 +1066,189 @@ class ChatBox:
 
         old_element: OutputElement = self.history[history_index]["elements"][element_index]
         if element is not None:
+            self._store_blobs([element])
+            if element is not old_element:
+                self._release_blobs([old_element])
             element.status_from(old_element)
             self.history[history_index]["elements"][element_index] = element
 
         self.history[history_index]["metadata"].update(metadata)
 
-        dg = old_element.update_element(
+        content = (element or old_element).content
+        size = len(content) if isinstance(content, (str, bytes)) else 0
+        dg = self._update_element(
+            old_element,
+            history_index,
             element,
             title=title,
             expanded=expanded,
             state=state,
+            render=self._should_flush(size, element_index, history_index, streaming),
         )
+        self._mark_dirty(history_index, force=not streaming)
         return dg
 
+    def stream(
+        self,
+        generator: Union[Iterable[str], AsyncIterable[str]],
+        *,
+        element_index: int = -1,
+        history_index: int = -1,
+        title: str = None,
+        expanded: bool = None,
+        state: str = "complete",
+        cursor: str = " ▌",
+        threaded: bool = False,
+        queue_size: int = 256,
+    ) -> str:
+        '''
+        consume text chunks from a sync or async iterator and stream them into an existing element.
+        chunks are buffered in a list and joined only when flushing, the element object is reused for the whole stream.
+        title/expanded/state are applied when the stream ends. return the full text.
+        threaded: run a sync iterator on a worker thread, so reading the source and rendering overlap.
+            chunks arrived during rendering are rendered in one batch. async iterators always run in background.
+        queue_size: max number of buffered chunks, the source is blocked when the queue is full.
+        '''
+        self.init_session()
+        if not self.history or not self.history[history_index]["elements"]:
+            return ""
+
+        if threaded or hasattr(generator, "__aiter__"):
+            batches = Producer(generator, queue_size).batches()
+        else:
+            batches = ([chunk] for chunk in generator)
+
+        element: OutputElement = self.history[history_index]["elements"][element_index]
+        if not isinstance(element, Markdown):
+            cursor = ""
+        buffer = []
+        size = 0
+        for batch in batches:
+            buffer.extend(batch)
+            size += sum(len(chunk) for chunk in batch)
+            if self._should_flush(size, element_index, history_index, True):
+                element._content = "".join(buffer) + cursor
+                self._update_element(element, history_index)
+
+        text = "".join(buffer)
+        element._content = text
+        self._should_flush(size, element_index, history_index, False)
+        self._update_element(element, history_index, title=title, expanded=expanded, state=state)
+        self._mark_dirty(history_index, force=True)
+        return text
+
+    def stream_elements(
+        self,
+        sources: Mapping[int, Union[Iterable[str], AsyncIterable[str]]],
+        *,
+        history_index: int = -1,
+        title: Union[str, Mapping[int, str]] = None,
+        expanded: Union[bool, Mapping[int, bool]] = None,
+        state: Union[str, Mapping[int, str]] = "complete",
+        cursor: str = " ▌",
+        queue_size: int = 256,
+    ) -> Dict[int, str]:
+        '''
+        stream several sources into elements of one message at the same time, such as answer, references and tool traces.
+        sources maps element index to a sync or async iterator of text chunks, they are drained concurrently in background.
+        chunks arrived in one frame are coalesced, so every element is rendered at most once per frame.
+        title/expanded/state can be a value for all elements or a mapping of element index to value,
+        they are applied to an element when its source ends. return full text of every element.
+        '''
+        self.init_session()
+        if not self.history or not sources:
+            return {}
+
+        def pick(value, i):
+            return value.get(i) if isinstance(value, Mapping) else value
+
+        elements: List[OutputElement] = self.history[history_index]["elements"]
+        buffers = {i: [] for i in sources}
+        sizes = {i: 0 for i in sources}
+        for chunks, finished in Producer(sources=sources, maxsize=queue_size).frames():
+            for i, batch in chunks.items():
+                buffers[i].extend(batch)
+                sizes[i] += sum(len(chunk) for chunk in batch)
+                if i not in finished and self._should_flush(sizes[i], i, history_index, True):
+                    element = elements[i]
+                    element._content = "".join(buffers[i]) + (cursor if isinstance(element, Markdown) else "")
+                    self._update_element(element, history_index)
+            for i in finished:
+                element = elements[i]
+                element._content = "".join(buffers[i])
+                self._should_flush(sizes[i], i, history_index, False)
+                self._update_element(element, history_index,
+                                     title=pick(title, i), expanded=pick(expanded, i), state=pick(state, i))
+
+        self._mark_dirty(history_index, force=True)
+        return {i: elements[i].content for i in sources}
+
+    def _container(self, history_index: int) -> Optional[DeltaGenerator]:
+        '''
+        container of a history message rendered in this run, None if it is out of the rendering window or not rendered.
+        '''
+        if history_index < 0:
+            history_index += len(self.history)
+        # containers are aligned with history after output_messages, otherwise they only cover messages added in this run
+        i = history_index - len(self.history) + len(self._chat_containers)
+        return self._chat_containers[i] if 0 <= i < len(self._chat_containers) else None
+
+    def _update_element(
+        self,
+        old_element: OutputElement,
+        history_index: int,
+        element: Optional[OutputElement] = None,
+        *,
+        title: str = None,
+        expanded: bool = None,
+        state: bool = None,
+        render: bool = True,
+    ) -> Optional[DeltaGenerator]:
+        '''
+        update element of a history message, only history is changed if the message is not rendered in this run.
+        '''
+        if self._container(history_index) is not None:
+            return old_element.update_element(element, title=title, expanded=expanded, state=state, render=render)
+        for attr, value in [("_title", title), ("_expanded", expanded), ("_state", state)]:
+            if value is not None:
+                setattr(element or old_element, attr, value)
+        return None
+
+    def _should_flush(
+        self,
+        size: int,
+        element_index: int,
+        history_index: int,
+        streaming: Optional[bool],
+    ) -> bool:
+        '''
+        decide whether a streaming update should be sent to the frontend now or buffered in history only.
+        '''
+        if history_index < 0:
+            history_index += len(self.history)
+        if element_index < 0:
+            element_index += len(self.history[history_index]["elements"])
+        key = (self._chat_name, history_index, element_index)
+
+        if not streaming:
+            self._stream_flushed.pop(key, None)
+            return True
+        if not self._stream_interval and not self._stream_min_chars:
+            return True
+
+        now = time.monotonic()
+        if key not in self._stream_flushed:
+            self._stream_flushed[key] = (now, size)
+            return True
+
+        last_time, last_size = self._stream_flushed[key]
+        if ((self._stream_interval and now - last_time >= self._stream_interval)
+            or (self._stream_min_chars and abs(size - last_size) >= self._stream_min_chars)):
+            self._stream_flushed[key] = (now, size)
+            return True
+        return False
+
+    @instrument("insert_msg", gauges=_history_length)
     def insert_msg(
         self,
         element: Union["OutputElement", str],
@@ -474,14 +1259,206 @@ class ChatBox:
         self.init_session()
         if isinstance(element, str):
             element = Markdown(element)
+        self._store_blobs([element])
         elements = self.history[history_index]["elements"]
         if pos < 0:
             pos += len(elements) + 1
         elements.insert(pos, element)
 
-        element(render_to=self._chat_containers[history_index])
+        if (container := self._container(history_index)) is not None:
+            element(render_to=container)
+        self._mark_dirty(history_index)
         return element
 
+    def archived_history(self, chat_name: str = None) -> List[Message]:
+        '''
+        raw messages replaced by summaries, in the original order.
+        '''
+        return list(self._load_chat({"history": self._archived_dicts(chat_name), "context": {}})["history"])
+
+    def _archived_dicts(self, name: str = None, chat: Dict = None) -> List[Dict]:
+        name = name or self.cur_chat_name
+        archive = []
+        if self._archive_store is not None:
+            archive += (self._archive_store.load(name) or {}).get("history", [])
+        # archives imported by from_dict/from_jsonl are kept in chat
+        if chat is None:
+            chat = self._get_chat(name) or {}
+        archive += chat.get("archive", [])
+        return archive
+
+    def compact(self, chat_name: str = None, force: bool = False) -> int:
+        '''
+        when history exceeds `compact_max_*` limits (or `force` is True),
+        replace older turns with a summary message and move them to archive,
+        so that the remaining messages take about half of the limits. return the number of archived messages.
+        turns are kept whole and the last turn is never compacted.
+        `kwargs["history_index"]` of feedback callbacks saved by `show_feedback` is shifted with the remaining messages.
+        other positions can not be remapped, so history with feedback callbacks taking positional `args` is only compacted if `force` is True.
+        '''
+        name = chat_name or self.cur_chat_name
+        chat = self._get_chat(name)
+        if chat is None:
+            return 0
+        history: ChatHistory = chat["history"]
+        limits = []
+        if self._compact_max_messages:
+            limits.append((self._compact_max_messages, lambda msg: 1))
+        if self._compact_max_bytes:
+            limits.append((self._compact_max_bytes, lambda msg: estimate_size({"history": [msg]})))
+        if self._compact_max_tokens:
+            limits.append((self._compact_max_tokens,
+                           lambda msg: sum(x.count_tokens(self._tokenizer) for x in msg["elements"])))
+        if not limits and not force:
+            return 0
+        self._check_archive_store()
+
+        start = 1 if history and history[0]["metadata"].get("summary") else 0
+        sizes = [[f(msg) for msg in history] for _, f in limits]
+        if not force and all(sum(x) <= limit for x, (limit, _) in zip(sizes, limits)):
+            return 0
+
+        # keep the latest messages within half of every limit, then move the cut to the start of a turn
+        cut = len(history)
+        totals = [0] * len(limits)
+        while cut > start:
+            values = [x[cut - 1] for x in sizes]
+            if any(t + v > limit // 2 for t, v, (limit, _) in zip(totals, values, limits)):
+                break
+            totals = [t + v for t, v in zip(totals, values)]
+            cut -= 1
+        while cut < len(history) and history[cut]["role"] != "user":
+            cut += 1
+        cut = min(cut, history.turn_start(1))
+        if cut <= start:
+            return 0
+        if not force and any("args" in msg["metadata"].get("feedback_kwargs", {}) for msg in history[cut:]):
+            return 0
+
+        summary = self._summarizer(history[:cut])
+        archived = [dump_value(msg) for msg in history[start:cut]]
+        if self._archive_store is not None:
+            offset = self._archive_store.count(name)
+            self._archive_store.write(name, {}, {offset + i: storable_message(msg) for i, msg in enumerate(archived)},
+                                      offset + len(archived))
+        else:
+            chat.setdefault("archive", []).extend(archived)
+        total = (history[0]["metadata"].get("archived", 0) if start else 0) + len(archived)
+
+        elements = self._prepare_elements(summary, role="assistant")
+        # blobs of archived elements are still referenced by archive, so they are not released
+        history[:cut] = [Message("assistant", elements, {"summary": True, "archived": total})]
+        for msg in history[1:]:
+            feedback_kwargs = msg["metadata"].get("feedback_kwargs", {})
+            kwargs = feedback_kwargs.get("kwargs")
+            if isinstance(kwargs, dict) and isinstance(index := kwargs.get("history_index"), int) and index >= cut:
+                feedback_kwargs["kwargs"] = {**kwargs, "history_index": index - cut + 1}
+        self._mark_dirty(None, name)
+        return len(archived)
+
+    def _check_archive_store(self) -> None:
+        '''
+        archives kept in session memory are lost when backend or history_cache drops the chat from memory.
+        '''
+        if self._archive_store is None and (self._backend is not None or self._history_cache is not None):
+            raise ValueError("archive_store is required to compact chats when backend or history_cache is set.")
+
+    def _save_archives(self) -> None:
+        '''
+        move archives imported by from_dict/from_jsonl to archive_store
+        '''
+        if self._archive_store is None:
+            return
+        for name, entry in st.session_state[self._session_key].items():
+            if "raw" in entry:
+                archive = entry["raw"].get("archive")
+                if archive:
+                    entry["raw"] = {k: v for k, v in entry["raw"].items() if k != "archive"}
+            else:
+                archive = (self._get_chat(name) or {}).pop("archive", None)
+            if archive:
+                self._archive_store.write(name, {}, dict(enumerate(archive)), len(archive))
+
+    def _mark_dirty(self, history_index: Optional[int], name: str = None, force: bool = False) -> None:
+        '''
+        mark a message (or all messages if history_index is None) as changed, to be written to backend and search index.
+        changes are flushed if `flush_interval` passed since last flush or `force` is True.
+        '''
+        if (state := st.session_state.get(self._search_key)) is not None:
+            if history_index is not None and history_index < 0:
+                history_index += len(self.other_history(name or self._chat_name))
+            state["pending"].add((name or self._chat_name, history_index))
+        if self._backend is None and self._history_cache is None:
+            return
+        name = name or self._chat_name
+        chat = self._get_chat(name)
+        if self._history_cache is not None:
+            self._history_cache.touch(self._cache_key(name))
+        if self._backend is None:
+            return
+        history = chat["history"]
+        dirty = chat.setdefault("dirty", set())
+        if history_index is None:
+            dirty.update(range(len(history)))
+        elif history:
+            dirty.add(history_index % len(history))
+        if force or time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        '''
+        write changed messages and context of all chats to backend in batches.
+        '''
+        if self._backend is None or not self.chat_inited:
+            return
+        for name, chat in st.session_state[self._session_key].items():
+            if "handle" in chat:
+                chat = self._history_cache.peek(chat["handle"]) or {}
+            if "dirty" not in chat:
+                continue
+            history = chat["history"]
+            messages = {i: storable_message(dump_value(history[i])) for i in chat.pop("dirty") if i < len(history)}
+            self._backend.write(name, dump_value(chat["context"]), messages, len(history))
+        self._last_flush = time.monotonic()
+
+
+@lru_cache(maxsize=256)
+def _cached_count_params(func: Callable) -> int:
+    return len(inspect.signature(func).parameters)
+
+
+def _count_params(func: Callable) -> int:
+    try:
+        return _cached_count_params(func)
+    except TypeError: # unhashable callable
+        return len(inspect.signature(func).parameters)
+
+
+class _count_stop:
+    '''
+    default stop of filter_history: stop when `history_len` user messages are filtered.
+    counts incrementally, assuming messages are only added between calls.
+    '''
+    def __init__(self, history_len: Optional[int]) -> None:
+        self._history_len = history_len
+        self._seen = 0
+        self._user_count = 0
+
+    def __call__(self, r: Sequence[Dict]) -> bool:
+        if not isinstance(self._history_len, int):
+            return False
+        if len(r) > self._seen:
+            self._user_count += r[0]["role"] == "user"
+            self._seen = len(r)
+        return self._user_count >= self._history_len
+
+
+def _get_fragment() -> Optional[Callable]:
+    '''
+    st.fragment for streamlit>=1.37, st.experimental_fragment for streamlit>=1.33, None for older versions.
+    '''
+    return getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
 
 class FakeLLM:
     def _answer(self, query: str) -> str:
@@ -498,6 +1475,14 @@ class FakeLLM:
             yield t, docs
             time.sleep(0.1)
 
+    async def achat_stream(self, query: str):
+        import asyncio
+
+        text, docs = self._answer(query)
+        for t in text:
+            yield t, docs
+            await asyncio.sleep(0.1)
+
 
 class FakeAgent:
     llm = FakeLLM()
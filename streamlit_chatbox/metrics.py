@@ -0,0 +1,167 @@
+from typing import *
+from collections import deque
+from functools import wraps
+import threading
+import time
+
+
+class _Series:
+    __slots__ = ("count", "seconds", "samples", "counters", "gauges")
+
+    def __init__(self, max_samples: int) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.samples = deque(maxlen=max_samples)
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+
+
+class Metrics:
+    '''
+    call counts, latencies and values recorded from instrumented methods of ChatBox and elements.
+    percentiles are computed from the latest `max_samples` calls of every method.
+    counters such as rendered bytes are summed up, gauges such as history length keep the last value.
+    hooks are called with (name, seconds, counters, gauges) after every recorded call.
+    '''
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, max_samples: int = 1024) -> None:
+        self._max_samples = max_samples
+        self._series: Dict[str, _Series] = {}
+        self._hooks: List[Callable[[str, float, Dict[str, float], Dict[str, float]], None]] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[str, float, Dict[str, float], Dict[str, float]], None]) -> None:
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[str, float, Dict[str, float], Dict[str, float]], None]) -> None:
+        self._hooks.remove(hook)
+
+    def observe(
+        self,
+        name: str,
+        seconds: float,
+        counters: Dict[str, float] = None,
+        gauges: Dict[str, float] = None,
+    ) -> None:
+        counters = counters or {}
+        gauges = gauges or {}
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = _Series(self._max_samples)
+            series.count += 1
+            series.seconds += seconds
+            series.samples.append(seconds)
+            for k, v in counters.items():
+                series.counters[k] = series.counters.get(k, 0) + v
+            series.gauges.update(gauges)
+        for hook in self._hooks:
+            hook(name, seconds, counters, gauges)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        '''
+        {name: {"count", "seconds", "quantiles": {q: seconds}, "counters": {key: total}, "gauges": {key: value}}}
+        '''
+        result = {}
+        with self._lock:
+            for name, series in self._series.items():
+                samples = sorted(series.samples)
+                result[name] = {
+                    "count": series.count,
+                    "seconds": series.seconds,
+                    "quantiles": {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in self.QUANTILES},
+                    "counters": dict(series.counters),
+                    "gauges": dict(series.gauges),
+                }
+        return result
+
+    def to_json(self) -> str:
+        import simplejson as json
+
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self, prefix: str = "streamlit_chatbox") -> str:
+        '''
+        metrics in prometheus text exposition format, every metric family is written as one group of its samples.
+        '''
+        # {family: (type, samples)}
+        families = {
+            f"{prefix}_calls_total": ("counter", []),
+            f"{prefix}_seconds": ("summary", []),
+        }
+
+        def add(family: str, type_: str, sample: str) -> None:
+            families.setdefault(family, (type_, []))[1].append(sample)
+
+        for name, s in self.snapshot().items():
+            label = f'method="{name}"'
+            add(f"{prefix}_calls_total", "counter", f"{prefix}_calls_total{{{label}}} {s['count']}")
+            for q, v in s["quantiles"].items():
+                add(f"{prefix}_seconds", "summary", f'{prefix}_seconds{{{label},quantile="{q}"}} {v}')
+            add(f"{prefix}_seconds", "summary", f"{prefix}_seconds_sum{{{label}}} {s['seconds']}")
+            add(f"{prefix}_seconds", "summary", f"{prefix}_seconds_count{{{label}}} {s['count']}")
+            for k, v in s["counters"].items():
+                add(f"{prefix}_{k}_total", "counter", f"{prefix}_{k}_total{{{label}}} {v}")
+            for k, v in s["gauges"].items():
+                add(f"{prefix}_{k}", "gauge", f"{prefix}_{k}{{{label}}} {v}")
+
+        lines = []
+        for family, (type_, samples) in families.items():
+            lines.append(f"# TYPE {family} {type_}")
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+
+_metrics: Optional[Metrics] = None
+
+
+def enable_metrics(metrics: Metrics = None) -> Metrics:
+    '''
+    start recording metrics of current process, return the Metrics object.
+    '''
+    global _metrics
+    _metrics = metrics or _metrics or Metrics()
+    return _metrics
+
+
+def disable_metrics() -> None:
+    global _metrics
+    _metrics = None
+
+
+def get_metrics() -> Optional[Metrics]:
+    return _metrics
+
+
+def instrument(
+    name: str,
+    counters: Callable[[Any], Dict[str, float]] = None,
+    gauges: Callable[[Any], Dict[str, float]] = None,
+) -> Callable:
+    '''
+    decorator of methods to record latency when metrics is enabled.
+    `counters` and `gauges` are called with the instance after the call and return extra values to record.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = _metrics
+            if metrics is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe(
+                    name,
+                    time.perf_counter() - start,
+                    counters(args[0]) if counters else None,
+                    gauges(args[0]) if gauges else None,
+                )
+        return wrapper
+    return decorator
@@ -0,0 +1,125 @@
+from typing import *
+from collections import Counter
+import heapq
+import math
+import re
+
+
+_TOKEN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[^\W\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+")
+
+
+def tokenize(text: str) -> List[str]:
+    '''
+    lowercase words, CJK characters are single tokens
+    '''
+    return _TOKEN_RE.findall(text.lower())
+
+
+# (chat_name, history_index, element_index)
+DocKey = Tuple[str, int, int]
+
+
+class SearchIndex:
+    '''
+    inverted index of message text, ranked by BM25.
+    documents are text elements, indexed and removed by message so that inserting elements to a message is supported.
+    '''
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, tokenizer: Callable[[str], List[str]] = tokenize) -> None:
+        self._tokenizer = tokenizer
+        self._postings: Dict[str, Dict[DocKey, int]] = {}
+        self._docs: Dict[DocKey, Counter] = {}
+        self._lengths: Dict[DocKey, int] = {}
+        self._messages: Dict[str, Dict[int, List[DocKey]]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def index_message(self, chat_name: str, history_index: int, texts: Dict[int, str]) -> None:
+        '''
+        replace documents of a message with `texts`: {element_index: text}
+        '''
+        self.remove_message(chat_name, history_index)
+        keys = []
+        for element_index, text in texts.items():
+            tokens = self._tokenizer(text)
+            if not tokens:
+                continue
+            key = (chat_name, history_index, element_index)
+            counts = Counter(tokens)
+            self._docs[key] = counts
+            self._lengths[key] = len(tokens)
+            self._total_length += len(tokens)
+            for token, tf in counts.items():
+                self._postings.setdefault(token, {})[key] = tf
+            keys.append(key)
+        if keys:
+            self._messages.setdefault(chat_name, {})[history_index] = keys
+
+    def remove_message(self, chat_name: str, history_index: int) -> None:
+        for key in self._messages.get(chat_name, {}).pop(history_index, []):
+            self._remove_doc(key)
+
+    def remove_chat(self, chat_name: str) -> None:
+        for keys in self._messages.pop(chat_name, {}).values():
+            for key in keys:
+                self._remove_doc(key)
+
+    def rename_chat(self, chat_name: str, new_name: str) -> None:
+        messages = self._messages.pop(chat_name, {})
+        new_messages = {}
+        for history_index, keys in messages.items():
+            new_keys = []
+            for key in keys:
+                counts = self._docs.pop(key)
+                length = self._lengths.pop(key)
+                new_key = (new_name, key[1], key[2])
+                self._docs[new_key] = counts
+                self._lengths[new_key] = length
+                for token, tf in counts.items():
+                    posting = self._postings[token]
+                    del posting[key]
+                    posting[new_key] = tf
+                new_keys.append(new_key)
+            new_messages[history_index] = new_keys
+        if new_messages:
+            self._messages[new_name] = new_messages
+
+    def _remove_doc(self, key: DocKey) -> None:
+        counts = self._docs.pop(key)
+        self._total_length -= self._lengths.pop(key)
+        for token in counts:
+            posting = self._postings[token]
+            del posting[key]
+            if not posting:
+                del self._postings[token]
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        chat_names: Iterable[str] = None,
+    ) -> List[Tuple[DocKey, float]]:
+        '''
+        return (key, score) of the best matched documents, in descending order of score
+        '''
+        if not self._docs:
+            return []
+        chat_names = set(chat_names) if chat_names is not None else None
+        n = len(self._docs)
+        avg_length = self._total_length / n
+        scores: Dict[DocKey, float] = {}
+        for token in set(self._tokenizer(query)):
+            posting = self._postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for key, tf in posting.items():
+                if chat_names is not None and key[0] not in chat_names:
+                    continue
+                norm = tf + self.K1 * (1 - self.B + self.B * self._lengths[key] / avg_length)
+                scores[key] = scores.get(key, 0) + idf * tf * (self.K1 + 1) / norm
+        return heapq.nsmallest(limit, scores.items(), key=lambda x: (-x[1], x[0]))
@@ -0,0 +1,405 @@
+from typing import *
+import io
+import os
+import struct
+from functools import lru_cache
+from types import ModuleType
+from streamlit_chatbox.elements import OutputElement
+from streamlit_chatbox.history import Message
+
+
+def dump_value(val: Any) -> Any:
+    '''
+    convert messages and elements nested in val to plain python objects
+    '''
+    if isinstance(val, (list, tuple)):
+        return [dump_value(x) for x in val]
+    elif isinstance(val, (dict, Message)):
+        return {k: dump_value(v) for k, v in val.items()}
+    elif isinstance(val, OutputElement):
+        return val.to_dict()
+    else:
+        return val
+
+
+class LineStream(io.RawIOBase):
+    '''
+    readable binary file object which pulls text lines from an iterator only when read.
+    it can be passed to st.download_button or any api accepts file objects.
+    '''
+    def __init__(self, lines: Iterable[str], encoding: str = "utf-8") -> None:
+        super().__init__()
+        self._lines = iter(lines)
+        self._encoding = encoding
+        self._buffer = b""
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # only rewinding before reading is supported, as st.download_button does
+        if whence == io.SEEK_SET and offset == self._pos == 0:
+            return 0
+        raise io.UnsupportedOperation("seek")
+
+    def readinto(self, b: bytearray) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = next(self._lines).encode(self._encoding)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self._pos += n
+        return n
+
+
+# binary format of `ChatBox.to_dict` state, version 1:
+#
+#   magic b"SCBX" | version: u8 | compression: u8
+#   one block per chat: records of (length: u32 | msgpack object), the first record is
+#       {"context": ..., "archived": n}, followed by n archived messages and then history messages
+#   index block: {"state": top level fields of to_dict, "chats": [[name, offset, size], ...]}
+#   trailer: index offset: u64 | index size: u32 | magic b"SCBX"
+#
+# integers are big endian. blocks are compressed independently, so a chat can be read without decoding others.
+# a message record is [role, metadata, elements], an element is the list of `ELEMENT_FIELDS` values.
+
+BINARY_MAGIC = b"SCBX"
+BINARY_VERSION = 1
+COMPRESSIONS = {None: 0, "zlib": 1, "zstd": 2}
+ELEMENT_FIELDS = ("content", "output_method", "title", "in_expander", "expanded", "state", "metadata", "kwargs")
+
+_HEADER = struct.Struct(">4sBB")
+_TRAILER = struct.Struct(">QI4s")
+_LENGTH = struct.Struct(">I")
+
+
+def _pack(obj: Any, buf: bytearray) -> None:
+    if isinstance(obj, str):
+        data = obj.encode("utf-8")
+        n = len(data)
+        if n < 32:
+            buf.append(0xa0 | n)
+        elif n < 0x100:
+            buf += struct.pack(">BB", 0xd9, n)
+        elif n < 0x10000:
+            buf += struct.pack(">BH", 0xda, n)
+        else:
+            buf += struct.pack(">BI", 0xdb, n)
+        buf += data
+    elif obj is None:
+        buf.append(0xc0)
+    elif obj is True:
+        buf.append(0xc3)
+    elif obj is False:
+        buf.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            buf.append(obj)
+        elif -32 <= obj < 0:
+            buf.append(obj & 0xff)
+        elif 0 <= obj < 0x100:
+            buf += struct.pack(">BB", 0xcc, obj)
+        elif 0 <= obj < 0x10000:
+            buf += struct.pack(">BH", 0xcd, obj)
+        elif 0 <= obj < 0x100000000:
+            buf += struct.pack(">BI", 0xce, obj)
+        elif 0 <= obj < 0x10000000000000000:
+            buf += struct.pack(">BQ", 0xcf, obj)
+        elif -0x80000000 <= obj < 0:
+            buf += struct.pack(">Bi", 0xd2, obj)
+        elif -0x8000000000000000 <= obj < 0:
+            buf += struct.pack(">Bq", 0xd3, obj)
+        else:
+            raise OverflowError(f"integer out of range: {obj}")
+    elif isinstance(obj, float):
+        buf += struct.pack(">Bd", 0xcb, obj)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        n = len(obj)
+        if n < 0x100:
+            buf += struct.pack(">BB", 0xc4, n)
+        elif n < 0x10000:
+            buf += struct.pack(">BH", 0xc5, n)
+        else:
+            buf += struct.pack(">BI", 0xc6, n)
+        buf += obj
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            buf.append(0x90 | n)
+        elif n < 0x10000:
+            buf += struct.pack(">BH", 0xdc, n)
+        else:
+            buf += struct.pack(">BI", 0xdd, n)
+        for x in obj:
+            _pack(x, buf)
+    elif isinstance(obj, Mapping):
+        n = len(obj)
+        if n < 16:
+            buf.append(0x80 | n)
+        elif n < 0x10000:
+            buf += struct.pack(">BH", 0xde, n)
+        else:
+            buf += struct.pack(">BI", 0xdf, n)
+        for k, v in obj.items():
+            _pack(k, buf)
+            _pack(v, buf)
+    else:
+        raise TypeError(f"can not serialize object of type {type(obj).__name__}")
+
+
+# structs of fixed size types, and of length prefixes of variable size types
+_FIXED = {
+    0xca: struct.Struct(">f"), 0xcb: struct.Struct(">d"),
+    0xcc: struct.Struct(">B"), 0xcd: struct.Struct(">H"), 0xce: struct.Struct(">I"), 0xcf: struct.Struct(">Q"),
+    0xd0: struct.Struct(">b"), 0xd1: struct.Struct(">h"), 0xd2: struct.Struct(">i"), 0xd3: struct.Struct(">q"),
+}
+_PREFIX = {
+    0xc4: struct.Struct(">B"), 0xc5: struct.Struct(">H"), 0xc6: struct.Struct(">I"),
+    0xd9: struct.Struct(">B"), 0xda: struct.Struct(">H"), 0xdb: struct.Struct(">I"),
+    0xdc: struct.Struct(">H"), 0xdd: struct.Struct(">I"),
+    0xde: struct.Struct(">H"), 0xdf: struct.Struct(">I"),
+}
+
+
+def _unpack(data: bytes, pos: int) -> Tuple[Any, int]:
+    b = data[pos]
+    pos += 1
+    if b <= 0x7f:
+        return b, pos
+    elif b >= 0xe0:
+        return b - 0x100, pos
+    elif 0xa0 <= b <= 0xbf:
+        end = pos + (b & 0x1f)
+        return data[pos:end].decode("utf-8"), end
+    elif b == 0xc0:
+        return None, pos
+    elif b == 0xc2:
+        return False, pos
+    elif b == 0xc3:
+        return True, pos
+    elif b in _FIXED:
+        s = _FIXED[b]
+        return s.unpack_from(data, pos)[0], pos + s.size
+    elif b <= 0x9f or b in _PREFIX:
+        if b <= 0x8f:
+            n, kind = b & 0x0f, 0xde
+        elif b <= 0x9f:
+            n, kind = b & 0x0f, 0xdc
+        else:
+            s = _PREFIX[b]
+            n, kind = s.unpack_from(data, pos)[0], b
+            pos += s.size
+        if kind <= 0xc6:
+            return bytes(data[pos:pos + n]), pos + n
+        elif kind <= 0xdb:
+            return data[pos:pos + n].decode("utf-8"), pos + n
+        elif kind <= 0xdd:
+            result = []
+            for _ in range(n):
+                x, pos = _unpack(data, pos)
+                result.append(x)
+            return result, pos
+        else:
+            result = {}
+            for _ in range(n):
+                k, pos = _unpack(data, pos)
+                result[k], pos = _unpack(data, pos)
+            return result, pos
+    raise ValueError(f"unsupported type byte 0x{b:02x} at {pos - 1}")
+
+
+@lru_cache(None)
+def _msgpack() -> Optional[ModuleType]:
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def pack(obj: Any) -> bytes:
+    '''
+    serialize plain python objects (None, bool, int, float, str, bytes, list, tuple, dict) to msgpack.
+    the msgpack package is used if installed, otherwise a pure python encoder.
+    '''
+    if msgpack := _msgpack():
+        return msgpack.packb(obj, use_bin_type=True)
+    buf = bytearray()
+    _pack(obj, buf)
+    return bytes(buf)
+
+
+def unpack(data: bytes) -> Any:
+    '''
+    deserialize msgpack bytes written by `pack`
+    '''
+    if msgpack := _msgpack():
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    obj, pos = _unpack(data, 0)
+    if pos != len(data):
+        raise ValueError(f"extra data after position {pos}")
+    return obj
+
+
+def _codec(compression: int) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    if compression == 0:
+        return bytes, bytes
+    elif compression == 1:
+        import zlib
+        return zlib.compress, zlib.decompress
+    elif compression == 2:
+        import zstandard
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"unsupported compression: {compression}")
+
+
+def _pack_message(msg: Dict) -> bytes:
+    elements = [[e.get(k) for k in ELEMENT_FIELDS] for e in msg["elements"]]
+    return pack([msg["role"], msg.get("metadata") or {}, elements])
+
+
+def _unpack_message(data: bytes) -> Dict:
+    role, metadata, elements = unpack(data)
+    return {
+        "role": role,
+        "elements": [dict(zip(ELEMENT_FIELDS, e)) for e in elements],
+        "metadata": metadata,
+    }
+
+
+def _records(block: bytes) -> Iterator[bytes]:
+    pos = 0
+    while pos < len(block):
+        n = _LENGTH.unpack_from(block, pos)[0]
+        pos += _LENGTH.size
+        yield block[pos:pos + n]
+        pos += n
+
+
+def dump_binary(
+    data: Dict,
+    fp: Union[str, os.PathLike, BinaryIO] = None,
+    compression: Literal["zlib", "zstd", None] = None,
+) -> Optional[bytes]:
+    '''
+    write state exported by `ChatBox.to_dict` to file path or binary file object `fp`, return bytes if fp is None.
+    every chat is compressed with zlib or zstd (requires zstandard) independently.
+    '''
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unsupported compression: {compression}")
+    compress, _ = _codec(COMPRESSIONS[compression])
+    if fp is None:
+        with io.BytesIO() as f:
+            dump_binary(data, f, compression)
+            return f.getvalue()
+    if isinstance(fp, (str, os.PathLike)):
+        with open(fp, "wb") as f:
+            return dump_binary(data, f, compression)
+
+    offset = _HEADER.size
+    fp.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, COMPRESSIONS[compression]))
+    chats = []
+    for name, chat in data["histories"].items():
+        archive = chat.get("archive") or []
+        records = [pack({"context": chat["context"], "archived": len(archive)})]
+        records += [_pack_message(msg) for msg in archive]
+        records += [_pack_message(msg) for msg in chat["history"]]
+        block = compress(b"".join(_LENGTH.pack(len(x)) + x for x in records))
+        fp.write(block)
+        chats.append([name, offset, len(block)])
+        offset += len(block)
+
+    state = {k: v for k, v in data.items() if k != "histories"}
+    index = compress(pack({"state": state, "chats": chats}))
+    fp.write(index)
+    fp.write(_TRAILER.pack(offset, len(index), BINARY_MAGIC))
+
+
+class BinaryReader:
+    '''
+    read file written by `dump_binary` from path, bytes or seekable binary file object.
+    only the index is decoded when opened, a chat is read and decoded when it is requested.
+    '''
+    def __init__(self, fp: Union[str, os.PathLike, bytes, BinaryIO]) -> None:
+        self._owned = False
+        if isinstance(fp, (bytes, bytearray, memoryview)):
+            fp = io.BytesIO(fp)
+        elif isinstance(fp, (str, os.PathLike)):
+            fp = open(fp, "rb")
+            self._owned = True
+        self._fp = fp
+        try:
+            self._start = fp.tell()
+            magic, version, compression = _HEADER.unpack(fp.read(_HEADER.size))
+            if magic != BINARY_MAGIC:
+                raise ValueError("not a chatbox binary file")
+            if version > BINARY_VERSION:
+                raise ValueError(f"unsupported binary format version: {version}")
+            _, self._decompress = _codec(compression)
+            fp.seek(-_TRAILER.size, io.SEEK_END)
+            offset, size, magic = _TRAILER.unpack(fp.read(_TRAILER.size))
+            if magic != BINARY_MAGIC:
+                raise ValueError("truncated chatbox binary file")
+            index = unpack(self._read(offset, size))
+        except BaseException:
+            self.close()
+            raise
+        self.state: Dict = index["state"]
+        self._chats: Dict[str, Tuple[int, int]] = {name: (offset, size) for name, offset, size in index["chats"]}
+
+    def _read(self, offset: int, size: int) -> bytes:
+        self._fp.seek(self._start + offset)
+        return self._decompress(self._fp.read(size))
+
+    def chat_names(self) -> List[str]:
+        return list(self._chats)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._chats
+
+    def load_chat(self, name: str) -> Dict:
+        '''
+        read a chat in the format of `ChatBox.to_dict`
+        '''
+        records = _records(self._read(*self._chats[name]))
+        head = unpack(next(records))
+        archive = [_unpack_message(next(records)) for _ in range(head["archived"])]
+        chat = {"history": [_unpack_message(x) for x in records], "context": head["context"]}
+        if archive:
+            chat["archive"] = archive
+        return chat
+
+    def load(self, chat_names: Iterable[str] = None) -> Dict:
+        '''
+        read state in the format of `ChatBox.to_dict`, only chats in `chat_names` are read if provided.
+        '''
+        names = self._chats if chat_names is None else [x for x in chat_names if x in self._chats]
+        return {**self.state, "histories": {name: self.load_chat(name) for name in names}}
+
+    def close(self) -> None:
+        if self._owned:
+            self._fp.close()
+
+    def __enter__(self) -> "BinaryReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def load_binary(
+    fp: Union[str, os.PathLike, bytes, BinaryIO],
+    chat_names: Iterable[str] = None,
+) -> Dict:
+    '''
+    read state written by `dump_binary` in the format of `ChatBox.to_dict`
+    '''
+    with BinaryReader(fp) as reader:
+        return reader.load(chat_names)
@@ -0,0 +1,205 @@
+from typing import *
+from pathlib import Path
+import threading
+
+
+def _jsonable(value: Any) -> bool:
+    import simplejson as json
+
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+_DROPPED = object()
+
+
+def _jsonable_only(value: Any) -> Any:
+    '''
+    drop values can not be saved as json from nested dicts and lists, such as callbacks in feedback_kwargs.
+    '''
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        items = ((k, _jsonable_only(v)) for k, v in value.items())
+        return {k: v for k, v in items if v is not _DROPPED}
+    if isinstance(value, (list, tuple)):
+        return [v for v in map(_jsonable_only, value) if v is not _DROPPED]
+    return value if _jsonable(value) else _DROPPED
+
+
+def storable_message(message: Dict) -> Dict:
+    '''
+    message dict with values can not be saved as json removed from its metadata.
+    '''
+    if not message.get("metadata"):
+        return message
+    return {**message, "metadata": _jsonable_only(message["metadata"])}
+
+
+class ChatStore:
+    '''
+    persistent storage backend of ChatBox.
+    chats are exchanged in the format of `ChatBox.to_dict()["histories"][name]`: {"history": [message dict], "context": dict}.
+    ChatBox writes changed messages in batches with `write`, and loads a chat only when it is accessed.
+    '''
+    def names(self) -> List[str]:
+        '''
+        names of chats in the order they are created
+        '''
+        raise NotImplementedError
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names()
+
+    def count(self, name: str) -> int:
+        '''
+        number of messages in chat
+        '''
+        raise NotImplementedError
+
+    def load(self, name: str, start: int = 0, end: int = None) -> Optional[Dict]:
+        '''
+        load context and messages[start:end] of chat, return None if chat not exists
+        '''
+        raise NotImplementedError
+
+    def write(
+        self,
+        name: str,
+        context: Dict,
+        messages: Dict[int, Dict],
+        length: int,
+    ) -> None:
+        '''
+        save context, upsert messages by index and drop messages with index >= length, in one transaction.
+        values of message metadata can not be saved as json, such as feedback callbacks, should be dropped by `storable_message`.
+        '''
+        raise NotImplementedError
+
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+    def rename(self, name: str, new_name: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        for name in self.names():
+            self.delete(name)
+
+
+class SQLiteChatStore(ChatStore):
+    '''
+    ChatStore saved in a local sqlite database. chats of different users can be separated by `namespace`.
+    the store is thread safe, share it between sessions with st.cache_resource.
+    '''
+    def __init__(
+        self,
+        path: Union[str, Path] = "chat_history.db",
+        namespace: str = "default",
+    ) -> None:
+        import sqlite3
+
+        self._path = str(path)
+        self._namespace = namespace
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chats ("
+                "namespace TEXT, name TEXT, context TEXT, seq INTEGER,"
+                "PRIMARY KEY (namespace, name))")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "namespace TEXT, chat TEXT, idx INTEGER, data TEXT,"
+                "PRIMARY KEY (namespace, chat, idx))")
+
+    def with_namespace(self, namespace: str) -> "SQLiteChatStore":
+        '''
+        a store sharing the same database connection with another namespace
+        '''
+        obj = object.__new__(type(self))
+        obj._path = self._path
+        obj._namespace = namespace
+        obj._lock = self._lock
+        obj._conn = self._conn
+        return obj
+
+    def names(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name FROM chats WHERE namespace=? ORDER BY seq", (self._namespace,)).fetchall()
+        return [r[0] for r in rows]
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM chats WHERE namespace=? AND name=?", (self._namespace, name)).fetchone()
+        return row is not None
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE namespace=? AND chat=?", (self._namespace, name)).fetchone()
+        return row[0]
+
+    def load(self, name: str, start: int = 0, end: int = None) -> Optional[Dict]:
+        import simplejson as json
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT context FROM chats WHERE namespace=? AND name=?", (self._namespace, name)).fetchone()
+            if row is None:
+                return None
+            if start < 0 or (end is not None and end < 0):
+                start, end, _ = slice(start, end).indices(self.count(name))
+            elif end is None:
+                end = 2 ** 62
+            rows = self._conn.execute(
+                "SELECT data FROM messages WHERE namespace=? AND chat=? AND idx>=? AND idx<? ORDER BY idx",
+                (self._namespace, name, start, end)).fetchall()
+        return {
+            "history": [json.loads(r[0]) for r in rows],
+            "context": json.loads(row[0]),
+        }
+
+    def write(
+        self,
+        name: str,
+        context: Dict,
+        messages: Dict[int, Dict],
+        length: int,
+    ) -> None:
+        import simplejson as json
+
+        params = [(self._namespace, name, i, json.dumps(storable_message(m), ensure_ascii=False))
+                  for i, m in messages.items()]
+        # context may contain widget values such as uploaded files, which can not be saved
+        context = {k: v for k, v in context.items() if _jsonable(v)}
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO chats (namespace, name, context, seq) "
+                "VALUES (?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM chats WHERE namespace=?)) "
+                "ON CONFLICT (namespace, name) DO UPDATE SET context=excluded.context",
+                (self._namespace, name, json.dumps(context, ensure_ascii=False), self._namespace))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (namespace, chat, idx, data) VALUES (?, ?, ?, ?)", params)
+            self._conn.execute(
+                "DELETE FROM messages WHERE namespace=? AND chat=? AND idx>=?", (self._namespace, name, length))
+
+    def delete(self, name: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chats WHERE namespace=? AND name=?", (self._namespace, name))
+            self._conn.execute("DELETE FROM messages WHERE namespace=? AND chat=?", (self._namespace, name))
+
+    def rename(self, name: str, new_name: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE chats SET name=? WHERE namespace=? AND name=?", (new_name, self._namespace, name))
+            self._conn.execute("UPDATE messages SET chat=? WHERE namespace=? AND chat=?", (new_name, self._namespace, name))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,177 @@
+from typing import *
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+_loop: Optional["asyncio.AbstractEventLoop"] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_loop_lock = threading.Lock()
+_DONE = object()
+
+
+def get_event_loop() -> "asyncio.AbstractEventLoop":
+    '''
+    the event loop running in a daemon thread of current process.
+    it is created once and reused across reruns and sessions,
+    so async clients and their connection pools can be kept alive between messages.
+    '''
+    import asyncio
+
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="streamlit_chatbox_loop", daemon=True).start()
+    return _loop
+
+
+def run_async(cor: Awaitable) -> Any:
+    '''
+    run coroutine on the managed event loop and wait for its result
+    '''
+    import asyncio
+
+    return asyncio.run_coroutine_threadsafe(cor, get_event_loop()).result()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    '''
+    the thread pool shared by producers of current process
+    '''
+    global _executor
+    with _loop_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix="streamlit_chatbox_producer")
+    return _executor
+
+
+class _Error:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+class Producer:
+    '''
+    consume a sync iterator on the shared thread pool, or an async iterator on the managed event loop,
+    and buffer chunks in a bounded queue. the producer blocks when the queue is full,
+    so a slow consumer applies backpressure to the source. call `cancel` or close the iterator to stop it.
+    pass `sources` instead of `source` to drain several iterators concurrently, chunks are grouped by their keys in `frames`.
+    '''
+    def __init__(
+        self,
+        source: Union[Iterable, AsyncIterable] = None,
+        maxsize: int = 256,
+        *,
+        sources: Mapping[Hashable, Union[Iterable, AsyncIterable]] = None,
+    ) -> None:
+        import asyncio
+
+        self._queue = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._futures = []
+        if sources is None:
+            sources = {None: source}
+        for key, src in sources.items():
+            if hasattr(src, "__aiter__"):
+                future = asyncio.run_coroutine_threadsafe(self._pump_async(key, src), get_event_loop())
+            else:
+                future = get_executor().submit(self._pump, key, src)
+            self._futures.append(future)
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _pump(self, key: Hashable, source: Iterable) -> None:
+        try:
+            for chunk in source:
+                if not self._put((key, chunk)):
+                    break
+        except BaseException as e:
+            self._put((key, _Error(e)))
+        finally:
+            if callable(close := getattr(source, "close", None)):
+                close()
+            self._put((key, _DONE))
+
+    async def _pump_async(self, key: Hashable, source: AsyncIterable) -> None:
+        import asyncio
+
+        async def put(item):
+            while not self._stop.is_set():
+                try:
+                    self._queue.put_nowait(item)
+                    return True
+                except queue.Full:
+                    await asyncio.sleep(0.01)
+            return False
+
+        try:
+            async for chunk in source:
+                if not await put((key, chunk)):
+                    break
+        except BaseException as e:
+            await put((key, _Error(e)))
+            raise
+        finally:
+            await put((key, _DONE))
+
+    def frames(self) -> Iterator[Tuple[Dict[Hashable, List], List[Hashable]]]:
+        '''
+        yield (chunks grouped by source key, keys of sources finished) for every frame.
+        a frame blocks only for its first item and takes all other available ones.
+        '''
+        pending = len(self._futures)
+        try:
+            while pending:
+                chunks = {}
+                finished = []
+                item = self._queue.get()
+                while True:
+                    key, chunk = item
+                    if chunk is _DONE:
+                        finished.append(key)
+                        pending -= 1
+                    elif isinstance(chunk, _Error):
+                        raise chunk.error
+                    else:
+                        chunks.setdefault(key, []).append(chunk)
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                yield chunks, finished
+        finally:
+            self.cancel()
+
+    def batches(self) -> Iterator[List]:
+        '''
+        yield lists of chunks of a single source, blocking only for the first chunk of a batch and taking all other available ones.
+        '''
+        for chunks, _ in self.frames():
+            if chunks:
+                yield chunks[None]
+
+    def __iter__(self) -> Iterator:
+        for batch in self.batches():
+            yield from batch
+
+    def cancel(self) -> None:
+        self._stop.set()
+        for future in self._futures:
+            future.cancel()
+
+
+def iter_async(agen: AsyncIterable) -> Iterator:
+    '''
+    iterate an async iterator from sync code, the iterator is driven on the managed event loop.
+    '''
+    return iter(Producer(agen))
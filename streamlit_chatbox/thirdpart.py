@@ -1,7 +1,28 @@
-from streamlit_markdown import st_markdown, st_hack_markdown
+from typing import *
 
 from .messages import ChatBox
 
 
-# ChatBox.register_output_method("richmd", st_markdown)
-ChatBox.register_output_method("richmd", st_hack_markdown)
+def _lazy(module: str, name: str) -> Callable:
+    '''
+    a function importing the real one on the first call, so thirdpart components are registered only when used.
+    '''
+    func = None
+
+    def wrapper(*args, **kwargs):
+        nonlocal func
+        if func is None:
+            func = getattr(__import__(module, fromlist=[name]), name)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def __getattr__(name: str) -> Any:
+    if name in ("st_markdown", "st_hack_markdown"):
+        import streamlit_markdown
+        return getattr(streamlit_markdown, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ChatBox.register_output_method("richmd", _lazy("streamlit_markdown", "st_markdown"))
+ChatBox.register_output_method("richmd", _lazy("streamlit_markdown", "st_hack_markdown"))
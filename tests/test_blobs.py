@@ -0,0 +1,43 @@
+from streamlit.testing.v1 import AppTest
+
+
+def _gc_with_raw_chat(root: str):
+    import streamlit as st
+    from streamlit_chatbox import ChatBox, BlobStore, Image
+
+    store = BlobStore(root)
+    box = ChatBox(use_rich_markdown=False, blob_store=store)
+    box.init_session()
+    image = Image(b"shared payload")
+    box._store_blobs([image])
+    message = {"role": "assistant", "elements": [image.to_dict()], "metadata": {}}
+    box.from_dict({
+        "cur_chat_name": "a",
+        "session_key": "chat_history",
+        "user_avatar": "user",
+        "assistant_avatar": "assistant",
+        "greetings": [],
+        "histories": {name: {"history": [message], "context": {}} for name in ["a", "b"]},
+    })
+    box.reset_history("a")
+    st.session_state["removed"] = store.gc(keep=box.blob_digests())
+    st.session_state["content"] = box.other_history("b")[0]["elements"][0].content.resolve()
+
+
+def test_gc_keeps_blobs_of_raw_chats(tmp_path):
+    at = AppTest.from_function(_gc_with_raw_chat, args=(str(tmp_path),)).run()
+    assert not at.exception
+    assert at.session_state["removed"] == []
+    assert at.session_state["content"] == b"shared payload"
+
+
+def test_from_dict_restores_blob_refs_of_media_only(tmp_path):
+    from streamlit_chatbox import BlobStore, BlobRef, OutputElement, Image, Markdown
+
+    store = BlobStore(tmp_path)
+    uri = store.put(b"payload").uri
+    assert isinstance(OutputElement.from_dict(Image(uri).to_dict(), store).content, BlobRef)
+    assert OutputElement.from_dict(Markdown(uri).to_dict(), store).content == uri
+    invalid = "blob:sha256:not-a-digest"
+    assert OutputElement.from_dict(Markdown(invalid).to_dict(), store).content == invalid
+    assert OutputElement.from_dict(Image(invalid).to_dict(), store).content == invalid
@@ -0,0 +1,111 @@
+from streamlit.testing.v1 import AppTest
+
+
+def _stream_while_evicted(path: str):
+    import streamlit as st
+    from streamlit_chatbox import ChatBox, HistoryCache, SQLiteChatStore
+
+    cache = HistoryCache(SQLiteChatStore(path), max_bytes=1)
+    box = ChatBox(use_rich_markdown=False, history_cache=cache, cache_namespace="user")
+    box.use_chat_name("a")
+    elements = box.ai_say("thinking")
+    # another chat is put into the cache while the element of chat "a" is being updated
+    ChatBox(use_rich_markdown=False, session_key="other", history_cache=cache, cache_namespace="user").init_session()
+    box.update_msg("answer", streaming=False)
+    elements[0]._content = "answer from stream"
+    st.session_state["content"] = cache.peek("user/chat_history/a")["history"][-1]["elements"][0].content
+
+
+def test_chats_in_use_are_not_evicted(tmp_path):
+    at = AppTest.from_function(_stream_while_evicted, args=(str(tmp_path / "spill.db"),)).run()
+    assert not at.exception
+    assert at.session_state["content"] == "answer from stream"
+
+
+def _render_shared(cache):
+    import streamlit as st
+    from streamlit_chatbox import ChatBox
+
+    box = ChatBox(use_rich_markdown=False, history_cache=cache, cache_namespace="user")
+    box.init_session()
+    if not box.history:
+        box.ai_say("shared")
+    st.session_state["place_holder"] = box.history[-1]["elements"][0].place_holder is not None
+    box.output_messages()
+
+
+def test_render_state_is_per_session(tmp_path):
+    from streamlit_chatbox import HistoryCache, SQLiteChatStore
+
+    cache = HistoryCache(SQLiteChatStore(tmp_path / "spill.db"))
+    first = AppTest.from_function(_render_shared, args=(cache,)).run()
+    second = AppTest.from_function(_render_shared, args=(cache,)).run()
+    assert not first.exception and not second.exception
+    assert len(cache.keys("user/")) == 1
+    # elements rendered by the first session have no place holder in the second one
+    assert second.session_state["place_holder"] is False
+    second.run()
+    assert second.session_state["place_holder"] is True
+
+
+class _JsonStore:
+    '''
+    spill store which saves messages as json, without filtering them.
+    '''
+    def __init__(self):
+        self.chats = {}
+
+    def names(self):
+        return list(self.chats)
+
+    def __contains__(self, name):
+        return name in self.chats
+
+    def load(self, name, start=0, end=None):
+        import json
+
+        return json.loads(self.chats[name]) if name in self.chats else None
+
+    def write(self, name, context, messages, length):
+        import json
+
+        self.chats[name] = json.dumps({"history": [messages[i] for i in range(length)], "context": context})
+
+    def delete(self, name):
+        self.chats.pop(name, None)
+
+
+def test_evict_drops_feedback_callbacks():
+    from streamlit_chatbox import HistoryCache, Message, Markdown, ChatHistory
+
+    spill = _JsonStore()
+    cache = HistoryCache(spill)
+    metadata = {"feedback_kwargs": {"feedback_type": "thumbs", "on_submit": print}}
+    cache.put("user/chat", {"history": ChatHistory([Message("assistant", [Markdown("answer")], metadata)]), "context": {}})
+    cache.evict("user/chat")
+    assert spill.load("user/chat")["history"][0]["metadata"] == {"feedback_kwargs": {"feedback_type": "thumbs"}}
+
+
+def _pin_chat(cache):
+    from streamlit_chatbox import ChatBox
+
+    box = ChatBox(use_rich_markdown=False, history_cache=cache, cache_namespace="user")
+    box.init_session()
+    box.history
+
+
+def test_pins_are_released_at_next_run(tmp_path):
+    import time
+    from streamlit_chatbox import HistoryCache, SQLiteChatStore
+
+    cache = HistoryCache(SQLiteChatStore(tmp_path / "spill.db"), idle_seconds=0.5)
+    at = AppTest.from_function(_pin_chat, args=(cache,)).run()
+    at.run()
+    key = "user/chat_history/default"
+    assert not at.exception
+    assert cache._pins == {key: 1}
+    # pins of a session without runs are released after idle_seconds, then the chat can be evicted
+    time.sleep(0.6)
+    cache.put("user/other", {"history": [], "context": {}})
+    assert cache._pins == {}
+    assert cache.peek(key) is None
@@ -0,0 +1,64 @@
+from streamlit.testing.v1 import AppTest
+
+
+def _compact_with_feedback():
+    import streamlit as st
+    from streamlit_chatbox import ChatBox
+
+    box = ChatBox(use_rich_markdown=False, compact_max_messages=4)
+    box.init_session()
+    for i in range(4):
+        box.user_say(f"question {i}")
+        box.ai_say(f"answer {i}")
+        feedback_kwargs = {"feedback_type": "thumbs", "kwargs": {"history_index": len(box.history) - 1}}
+        box.history[-1]["metadata"]["feedback_kwargs"] = feedback_kwargs
+    st.session_state["archived"] = box.compact()
+    st.session_state["indexes"] = [
+        (i, msg["metadata"]["feedback_kwargs"]["kwargs"]["history_index"])
+        for i, msg in enumerate(box.history) if "feedback_kwargs" in msg["metadata"]
+    ]
+
+    for i in range(4, 8):
+        box.user_say(f"question {i}")
+        box.ai_say(f"answer {i}")
+    box.history[-1]["metadata"]["feedback_kwargs"] = {"feedback_type": "thumbs", "args": (len(box.history) - 1,)}
+    st.session_state["positional"] = box.compact()
+
+
+def test_compact_remaps_feedback_index():
+    at = AppTest.from_function(_compact_with_feedback).run()
+    assert not at.exception
+    assert at.session_state["archived"] > 0
+    assert at.session_state["indexes"] and all(i == j for i, j in at.session_state["indexes"])
+    # positional callback args can not be remapped
+    assert at.session_state["positional"] == 0
+
+
+def _compact_with_backend(path: str):
+    import streamlit as st
+    from streamlit_chatbox import ChatBox, SQLiteChatStore
+
+    backend = SQLiteChatStore(path)
+    box = ChatBox(use_rich_markdown=False, compact_max_messages=4,
+                  backend=backend, archive_store=backend.with_namespace("archive"))
+    box.init_session()
+    for i in range(5):
+        box.user_say(f"question {i}")
+        box.ai_say(f"answer {i}")
+    box.compact()
+    archived = len(box.archived_history())
+    box.use_chat_name("other")
+    box.use_chat_name("default")
+    st.session_state["archived"] = (archived, len(box.archived_history()), len(box.to_dict()["histories"]["default"]["archive"]))
+    try:
+        ChatBox(compact_max_messages=4, backend=backend)
+    except ValueError:
+        st.session_state["rejected"] = True
+
+
+def test_compact_with_backend_keeps_archive(tmp_path):
+    at = AppTest.from_function(_compact_with_backend, args=(str(tmp_path / "chat.db"),)).run()
+    assert not at.exception
+    archived, after_switch, exported = at.session_state["archived"]
+    assert archived > 0 and archived == after_switch == exported
+    assert at.session_state["rejected"]
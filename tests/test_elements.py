@@ -0,0 +1,24 @@
+from streamlit.testing.v1 import AppTest
+
+
+def _native_markdown():
+    from streamlit_chatbox import Markdown
+
+    Markdown("<b>hi</b>", use_rich_markdown=True)(native=True)
+
+
+def test_native_markdown_allows_html():
+    at = AppTest.from_function(_native_markdown).run()
+    assert not at.exception
+    assert [x.allow_html for x in at.markdown] == [True]
+
+
+def test_render_plans_are_shared_without_kwargs():
+    from streamlit_chatbox import Markdown
+
+    first, second = Markdown("a"), Markdown("b")
+    assert first._render_plan(True) is second._render_plan(True)
+    assert first._plan is None and second._plan is None
+    first._set_kwargs(help="tip")
+    assert first._render_plan(True)[1]["help"] == "tip"
+    assert "help" not in second._render_plan(True)[1]
@@ -0,0 +1,14 @@
+import pytest
+
+from streamlit_chatbox import Message, Markdown
+
+
+def test_message_copy_is_plain_dict():
+    element = Markdown("answer")
+    msg = Message("assistant", [element], {"source": "llm"})
+    copied = msg.copy()
+    assert type(copied) is dict
+    assert copied == {"role": "assistant", "elements": [element], "metadata": {"source": "llm"}}
+    copied["extra"] = 1
+    with pytest.raises(KeyError):
+        msg["extra"] = 1
@@ -0,0 +1,42 @@
+from streamlit.testing.v1 import AppTest
+
+
+def _update_out_of_window():
+    import streamlit as st
+    from streamlit_chatbox import ChatBox
+
+    box = ChatBox(use_rich_markdown=False)
+    box.init_session()
+    if not box.history:
+        box.user_say("question")
+        box.ai_say("answer")
+        return
+    box.output_messages(window_size=1)
+    # the question is out of the window, it was rendered in the previous run only
+    box.update_msg("updated", history_index=0, streaming=False)
+    box.update_msg("updated answer", streaming=False)
+    st.session_state["content"] = box.history[0]["elements"][0].content
+
+
+def test_update_msg_out_of_window():
+    at = AppTest.from_function(_update_out_of_window).run().run()
+    assert not at.exception
+    assert at.session_state["content"] == "updated"
+    assert [md.value for md in at.markdown] == ["updated answer"]
+
+
+def _filter_with_custom_stop():
+    import streamlit as st
+    from streamlit_chatbox import ChatBox
+
+    box = ChatBox(use_rich_markdown=False)
+    for i in range(3):
+        box.user_say(f"question {i}")
+        box.ai_say(f"answer {i}")
+    st.session_state["result"] = box.filter_history(stop=lambda r: len(r[1:]) >= 2)
+
+
+def test_filter_history_custom_stop_receives_list():
+    at = AppTest.from_function(_filter_with_custom_stop).run()
+    assert not at.exception
+    assert [msg["content"] for msg in at.session_state["result"]] == ["answer 1", "question 2", "answer 2"]
@@ -0,0 +1,18 @@
+import pytest
+
+from streamlit_chatbox.metrics import Metrics
+
+
+def test_prometheus_families_are_grouped():
+    parser = pytest.importorskip("prometheus_client.parser")
+
+    metrics = Metrics()
+    metrics.observe("render", 0.1, {"bytes": 10})
+    metrics.observe("user_say", 0.2, None, {"history_length": 3})
+    families = {f.name: f for f in parser.text_string_to_metric_families(metrics.to_prometheus())}
+    assert families["streamlit_chatbox_calls"].type == "counter"
+    assert len(families["streamlit_chatbox_calls"].samples) == 2
+    assert families["streamlit_chatbox_seconds"].type == "summary"
+    assert len(families["streamlit_chatbox_seconds"].samples) == 10
+    assert families["streamlit_chatbox_bytes"].type == "counter"
+    assert families["streamlit_chatbox_history_length"].type == "gauge"
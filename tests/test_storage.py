@@ -0,0 +1,66 @@
+from streamlit.testing.v1 import AppTest
+
+
+def _switch_and_export(path: str):
+    import streamlit as st
+    from streamlit_chatbox import ChatBox, SQLiteChatStore
+
+    box = ChatBox(use_rich_markdown=False, backend=SQLiteChatStore(path))
+    box.init_session()
+    box.use_chat_name("a")
+    for i in range(5):
+        box.ai_say(f"in a {i}")
+    box.use_chat_name("b")
+    st.session_state["names"] = box.get_chat_names()
+    st.session_state["json"] = box.to_json()
+    st.session_state["jsonl"] = list(box.iter_jsonl())
+    st.session_state["loaded"] = list(st.session_state["chat_history"])
+    box.use_chat_name("a")
+    st.session_state["names_after_switch"] = box.get_chat_names()
+
+
+def test_export_with_backend_after_chat_switch(tmp_path, monkeypatch):
+    import json
+    from streamlit_chatbox import messages
+
+    # chats in backend are exported page by page
+    monkeypatch.setattr(messages, "BACKEND_PAGE_SIZE", 2)
+    at = AppTest.from_function(_switch_and_export, args=(str(tmp_path / "chat.db"),)).run()
+    assert not at.exception
+    data = json.loads(at.session_state["json"])
+    assert set(data["histories"]) == {"default", "a", "b"}
+    assert [x["elements"][0]["content"] for x in data["histories"]["a"]["history"]] == [f"in a {i}" for i in range(5)]
+    lines = [json.loads(x) for x in at.session_state["jsonl"]]
+    assert [x["elements"][0]["content"] for x in lines if x["type"] == "message"] == [f"in a {i}" for i in range(5)]
+    # chats only in backend are exported without loading them to session
+    assert at.session_state["loaded"] == ["b"]
+    assert at.session_state["names"] == at.session_state["names_after_switch"] == ["default", "a", "b"]
+
+
+def _feedback_with_backend(path: str):
+    from streamlit_chatbox import ChatBox, SQLiteChatStore
+
+    def on_feedback(feedback, history_index=-1):
+        pass
+
+    box = ChatBox(use_rich_markdown=False, backend=SQLiteChatStore(path))
+    box.init_session()
+    box.output_messages()
+    if not box.history:
+        box.user_say("question")
+        box.ai_say("answer")
+        box.show_feedback(feedback_type="thumbs", on_submit=on_feedback,
+                          kwargs={"history_index": len(box.history) - 1})
+
+
+def test_feedback_callback_with_backend(tmp_path):
+    from streamlit_chatbox import SQLiteChatStore
+
+    path = str(tmp_path / "chat.db")
+    at = AppTest.from_function(_feedback_with_backend, args=(path,)).run()
+    assert not at.exception
+    at.run()
+    assert not at.exception
+    # callbacks are dropped, other feedback kwargs are saved
+    feedback_kwargs = SQLiteChatStore(path).load("default")["history"][-1]["metadata"]["feedback_kwargs"]
+    assert feedback_kwargs == {"feedback_type": "thumbs", "kwargs": {"history_index": 1}}